@@ -0,0 +1,143 @@
+"""
+A store for the files harvested from assemblies (FASTAs and graphs), kept in the output
+directory's ARTIFACTS directory.
+
+Harvesting just moves a file into the store, so the assembly directory can be deleted straight
+away. The file is then compressed in a background thread. Artifacts are stored by the SHA-256 of
+their (uncompressed) contents, so identical files (e.g. SPAdes contigs and scaffolds from a
+simple genome) are only stored once. Each assembly's named file in the output directory (e.g.
+<name>.fasta.gz) is a hard link to its artifact.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+ARTIFACTS_DIR_NAME = 'ARTIFACTS'
+
+artifact_stores = {}
+artifact_stores_lock = threading.Lock()
+
+
+class ArtifactStore(object):
+    def __init__(self, out_dir, threads=2):
+        self.out_dir = out_dir
+        self.dir = os.path.join(out_dir, ARTIFACTS_DIR_NAME)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.lock = threading.Lock()
+        self.pending = {}  # artifact filename -> Event set when it exists
+
+    def add(self, source, dest, keep_source=False):
+        """
+        Moves (or with keep_source, copies) the source file into the store, to appear as
+        dest + '.gz'. Returns that filename and a Future which finishes when it exists.
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        temp_fd, incoming = tempfile.mkstemp(dir=self.dir, prefix='.incoming_')
+        os.close(temp_fd)
+        if keep_source:
+            shutil.copyfile(source, incoming)
+        else:
+            shutil.move(source, incoming)
+        dest += '.gz'
+        return dest, self.executor.submit(self.store, incoming, dest)
+
+    def store(self, incoming, dest):
+        extension = os.path.basename(dest)[:-3].rsplit('.', 1)[-1]
+        digest = get_sha256(incoming)
+        artifact = os.path.join(self.dir, digest[:2], digest + '.' + extension + '.gz')
+
+        # If another thread is already compressing an identical file, just wait for it.
+        with self.lock:
+            if artifact in self.pending:
+                event, compress = self.pending[artifact], False
+            else:
+                event = self.pending[artifact] = threading.Event()
+                compress = True
+        if compress:
+            try:
+                if not os.path.isfile(artifact):
+                    compress_file(incoming, artifact)
+            finally:
+                event.set()
+                with self.lock:
+                    del self.pending[artifact]
+        else:
+            event.wait()
+        os.remove(incoming)
+        link_file(artifact, dest)
+        print('Stored ' + os.path.basename(dest) + ' (' + digest[:12] + ')', flush=True)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def get_artifact_store(out_dir, threads=2):
+    with artifact_stores_lock:
+        if out_dir not in artifact_stores:
+            artifact_stores[out_dir] = ArtifactStore(out_dir, threads)
+        return artifact_stores[out_dir]
+
+
+def shutdown_artifact_stores():
+    with artifact_stores_lock:
+        stores = list(artifact_stores.values())
+    for store in stores:
+        store.shutdown()
+
+
+def get_sha256(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as data_file:
+        while True:
+            chunk = data_file.read(1048576)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def compress_file(source, dest):
+    """
+    Gzips the source to dest, which only appears once it is complete.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    temp_filename = get_temp_filename(dest)
+    try:
+        with open(source, 'rb') as source_file, open(temp_filename, 'wb') as temp_file:
+            with gzip.GzipFile(filename='', fileobj=temp_file, mode='wb', compresslevel=6,
+                               mtime=0) as gz:
+                shutil.copyfileobj(source_file, gz, 1048576)
+        os.replace(temp_filename, dest)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+def link_file(source, dest):
+    """
+    Makes dest a hard link to source (replacing any existing dest), or a copy if the filesystem
+    doesn't support hard links.
+    """
+    temp_filename = get_temp_filename(dest)
+    try:
+        os.link(source, temp_filename)
+    except OSError:
+        shutil.copyfile(source, temp_filename)
+    os.replace(temp_filename, dest)
+
+
+def get_temp_filename(filename):
+    """
+    A temporary name for a file, unique to this process and thread (unlike tempfile.mkstemp,
+    the file gets the usual permissions).
+    """
+    return filename + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
@@ -15,16 +15,40 @@ import os
 import shutil
 import subprocess
 import sys
-import time
 import copy
 import fcntl
+import gzip
+import re
+import tempfile
+import threading
+import time
 from collections import OrderedDict
-import unicycler.assembly_graph
-from unicycler_assembly_tests.misc import load_fasta
+from unicycler_assembly_tests.command_runner import AssemblyRun, CommandResult, run_command, \
+    install_signal_handlers
+from unicycler_assembly_tests.contiguity import get_fasta_length
+from unicycler_assembly_tests.misc import parse_duration, format_duration
+from unicycler_assembly_tests.reference_index import get_reference_info
+from unicycler_assembly_tests.version_cache import get_default_cache_dir, get_version_cache_key, \
+    get_cached_version, save_cached_version
+
+
+# Read sets this process has claimed in worker mode.
+claimed_read_sets = set()
+
+# The successful assemblies in results.tsv (see get_done_assemblies), by the table's version.
+done_assemblies_cache = {}
+done_assemblies_lock = threading.Lock()
+
+# Concurrent jobs reserve this much more than their predicted peak memory.
+PREDICTED_MEM_MARGIN = 1.5
+
+# The thread count put in place of THREADS in command files, unless --threads is used.
+DEFAULT_THREADS = 8
 
 
 def main():
     args = get_arguments()
+    install_signal_handlers()
 
     read_sets = []
     if args.real_read_dir:
@@ -32,9 +56,13 @@ def main():
     if args.fake_read_dir:
         read_sets += group_fake_reads(args.fake_read_dir)
 
-    commands = Commands(args.command_file)
-    assembly_dir = os.path.join(args.out_dir, 'ASSEMBLY_TEMP_' + str(os.getpid()))
-    create_results_table(args.out_dir)
+    commands = Commands(args.command_file, args.cache_dir, args.threads)
+    if args.thread_sweep:
+        if not commands.uses_threads_placeholder():
+            sys.exit('--thread_sweep needs a command file which uses THREADS')
+        sweep_commands = [commands.with_threads(x, sweep=True) for x in args.thread_sweep]
+    else:
+        sweep_commands = [commands]
 
     # Remove read sets this assembler can't handle. E.g. if it's a hybrid read set and a short
     # read only assembler.
@@ -52,30 +80,572 @@ def main():
         for read_set in read_sets:
             read_set.find_reference(args.ref_dir)
 
+    if args.dry_run:
+        for level_commands in sweep_commands:
+            print_dry_run(level_commands, read_sets, args.out_dir)
+        if args.depth_sweep:
+            print('The depth sweep\'s subsampled read sets are made when the run starts, so '
+                  'they aren\'t listed above.')
+        return
+    create_results_table(args.out_dir, args.results_backend)
+    if args.read_profile:
+        read_sets = profile_read_sets(commands, read_sets, args)
+    if args.depth_sweep:
+        depth_read_sets = make_depth_read_sets(sweep_commands, read_sets, args)
+        read_sets += profile_read_sets(commands, depth_read_sets, args)
+    read_sets = plan_read_sets(sweep_commands[0], read_sets, args)
+
     print('\n')
     print(bold_yellow_underline('Read sets to assemble'))
     if not read_sets:
         print('None')
     for read_set in read_sets:
-        print(str(read_set))
-    print('\nAssembly temp directory: ' + assembly_dir + '\n', flush=True)
+        print(str(read_set) + get_prediction_str(read_set))
+    if not args.thread_sweep:
+        print_predicted_makespan(sweep_commands[0], read_sets, args)
+    print('', flush=True)
+
+    if args.quast_batch_size > 0 and not args.fast_eval:
+        from unicycler_assembly_tests.quast_runner import QuastBatcher
+        quast_batcher = QuastBatcher(args.out_dir, args.quast_batch_size, args.quast_threads,
+                                     load_queued_assembly, finish_evaluation)
+    else:
+        quast_batcher = None
+
+    from unicycler_assembly_tests.artifact_store import get_artifact_store, \
+        shutdown_artifact_stores
+    get_artifact_store(args.out_dir, args.compress_threads)
+    try:
+        for level_commands in sweep_commands:
+            if args.thread_sweep:
+                print()
+                print(bold_yellow_underline('Thread sweep: ' + str(level_commands.threads) +
+                                            ' threads'))
+                # Each level is predicted from past runs with its own thread count.
+                if level_commands is not sweep_commands[0]:
+                    read_sets = plan_read_sets(level_commands, read_sets, args)
+                print_predicted_makespan(level_commands, read_sets, args)
+            if args.worker:
+                run_worker(level_commands, read_sets, args, quast_batcher)
+            else:
+                run_read_sets(level_commands, read_sets, args, quast_batcher)
+        if quast_batcher is not None:
+            quast_batcher.flush()
+        shutdown_artifact_stores()
+    finally:
+        export_results_table(args.out_dir)
+
+    if args.thread_sweep:
+        from unicycler_assembly_tests.thread_scaling import write_scaling_report
+        write_scaling_report(os.path.join(args.out_dir, 'results.tsv'),
+                             os.path.join(args.out_dir, 'thread_scaling.tsv'))
+    if args.depth_sweep:
+        from unicycler_assembly_tests.depth_scaling import write_depth_report
+        from unicycler_assembly_tests.subsample import format_depth
+        write_depth_report(os.path.join(args.out_dir, 'results.tsv'),
+                           os.path.join(args.out_dir, 'depth_scaling.tsv'),
+                           [format_depth(x) for x in args.depth_sweep])
+
+
+def assemble_read_set(commands, read_set, args, eval_scheduler=None, quast_batcher=None):
+    """
+    Assembles one read set. The assembly is evaluated here unless an evaluation scheduler is
+    given, in which case the evaluation is queued and this function returns as soon as the
+    assembly's files are harvested.
+    """
+    out_dir = args.out_dir
+    print()
+    print(bold_yellow_underline('Read set: ' + read_set.set_name))
+
+    # Don't bother if the file already exists. This lets us resume crashed/stopped runs
+    # without repeating too much work.
+    if is_already_done(read_set, commands, out_dir):
+        print('Already done')
+        return
+
+    # In worker mode, the read set is first claimed with a lease (so other workers sharing the
+    # output directory will skip it), which is held until the result is written.
+    if args.worker:
+        lease = claim_read_set(commands, read_set, args)
+        if lease is None:
+            return
+    else:
+        lease = None
+    harvested_outputs = []
+    try:
+        harvested_outputs = assemble_and_harvest(commands, read_set, args, lease)
+    finally:
+        if lease is not None and not harvested_outputs:
+            lease.release()
+    if lease is not None and harvested_outputs:
+        lease.share(len(harvested_outputs))  # released when the last output is written
+    for harvested in harvested_outputs:
+        harvested.lease = lease
+        if eval_scheduler is None:
+            evaluate_results(harvested, args.quast_threads, args.fast_eval, quast_batcher)
+        else:
+            from unicycler_assembly_tests.scheduler import Job
+            eval_scheduler.submit(Job('Evaluate ' + read_set.set_name, evaluate_results,
+                                      (harvested, 1, args.fast_eval, quast_batcher), cores=1))
+
+
+def assemble_and_harvest(commands, read_set, args, lease=None):
+    """
+    Runs the assembly (unless it is in the result cache) and harvests the files of each of its
+    outputs which isn't already done. Returns a list of HarvestedAssembly objects to evaluate.
+    If the read set's lease is lost partway, the assembly is abandoned (nothing is harvested), as
+    another worker has taken it over.
+    """
+    out_dir = args.out_dir
+    outputs = [x for x in commands.get_output_commands(read_set)
+               if not is_output_done(read_set, x, out_dir)]
+    if not outputs:
+        return []
+    if args.result_cache:
+        cache_keys = [get_cache_key(x, read_set, args.fast_eval) for x in outputs]
+        if restore_cached_results(outputs, read_set, cache_keys, out_dir):
+            for cache_key in cache_keys:
+                print('Restored from result cache: ' + cache_key)
+            return []
+    else:
+        cache_keys = [None for _ in outputs]
+
+    assembly_dir = make_assembly_dir(args.scratch_dir if args.scratch_dir else out_dir)
+    print('Assembly temp directory: ' + assembly_dir, flush=True)
+    if args.enforce_mem:
+        from unicycler_assembly_tests.memory_limit import MemoryLimit
+        _, job_mem = get_job_resources(commands, args)
+        memory_limit = MemoryLimit(job_mem, os.path.basename(assembly_dir))
+        print('Memory limit: ' + '%.1f' % job_mem + ' GB (' + memory_limit.get_method() + ')',
+              flush=True)
+        if memory_limit.get_method() == 'rlimit':
+            print(red('Warning: no usable cgroup, so the memory limit applies to each process '
+                      'separately, not to the whole job'), flush=True)
+    else:
+        memory_limit = None
+    # The assembler is given the staged reads, but the results still refer to the originals.
+    if args.scratch_dir:
+        from unicycler_assembly_tests.read_staging import stage_read_set
+        assembly_read_set, staged_files = stage_read_set(read_set, args.scratch_dir,
+                                                         args.decompress_reads)
+    else:
+        assembly_read_set, staged_files = read_set, []
+    try:
+        assembly_run = execute_commands(commands, assembly_read_set, assembly_dir,
+                                        args.sample_interval, memory_limit, args.tee,
+                                        args.command_timeout, args.job_timeout,
+                                        args.stall_timeout,
+                                        commands.cache_dir if args.step_cache else None,
+                                        lease)
+    finally:
+        if memory_limit is not None:
+            memory_limit.remove()
+        for staged_file in staged_files:
+            staged_file.release(args.clean_scratch)
+    if assembly_run.abandoned or (lease is not None and lease.lost):
+        print(red('Lost the lease for ' + read_set.set_name + ' to another worker, so '
+                  'abandoning its assembly'), flush=True)
+        shutil.rmtree(assembly_dir)
+        return []
+
+    # Files which a later output also needs are copied rather than moved.
+    harvested_outputs = []
+    for i, output_commands in enumerate(outputs):
+        keep_files = set()
+        for later_output in outputs[i + 1:]:
+            keep_files.add(os.path.join(assembly_dir, later_output.final_assembly_fasta))
+            if later_output.final_assembly_graph:
+                keep_files.add(os.path.join(assembly_dir, later_output.final_assembly_graph))
+            keep_files.update([assembly_run.log_filename, assembly_run.samples_filename])
+        harvested = harvest_results(output_commands, read_set, assembly_dir, assembly_run,
+                                    out_dir, keep_files)
+        if harvested is None:
+            continue
+        if cache_keys[i] is not None:
+            harvested.result.results['Cache key'] = cache_keys[i]
+            harvested.cache_dir, harvested.cache_key = commands.cache_dir, cache_keys[i]
+        harvested_outputs.append(harvested)
+    shutil.rmtree(assembly_dir)
+    return harvested_outputs
+
+
+def claim_read_set(commands, read_set, args):
+    """
+    Returns the read set's lease, or None if another worker has it (or has finished it, or its
+    assembly failed there).
+    """
+    from unicycler_assembly_tests.leases import Lease, get_failed_holder, get_failure_filename
+    lease_dir, lease_name = get_lease_dir(args.out_dir), get_lease_name(read_set, commands)
+    failed_holder = get_failed_holder(lease_dir, lease_name)
+    if failed_holder:
+        print('Failed on worker ' + failed_holder + ', so not retried (delete ' +
+              get_failure_filename(lease_dir, lease_name) + ' to retry it)')
+        return None
+    lease = Lease(lease_dir, lease_name, args.lease_timeout)
+    if not lease.acquire():
+        print('Claimed by another worker: ' + lease.get_holder())
+        return None
+    claimed_read_sets.add(read_set.set_name)
+    if is_already_done(read_set, commands, args.out_dir):  # finished since the first check
+        lease.release()
+        print('Already done')
+        return None
+    return lease
+
+
+def get_lease_dir(out_dir):
+    from unicycler_assembly_tests.leases import LEASE_DIR_NAME
+    return os.path.join(out_dir, LEASE_DIR_NAME)
+
+
+def get_lease_name(read_set, commands):
+    copied_fasta_name, _ = get_copied_fasta_name(read_set, commands, '')
+    return copied_fasta_name[:-len('.fasta')]
+
+
+def run_worker(commands, read_sets, args, quast_batcher=None):
+    """
+    Runs the read sets as one of possibly many workers sharing the output directory. Read sets
+    claimed by other workers are skipped, but are checked again (until they are finished) in case
+    their worker dies and its lease expires.
+    """
+    from unicycler_assembly_tests.leases import is_leased
+    lease_dir = get_lease_dir(args.out_dir)
+    while read_sets:
+        run_read_sets(commands, read_sets, args, quast_batcher)
+        read_sets = [x for x in read_sets if x.set_name not in claimed_read_sets and
+                     is_leased(lease_dir, get_lease_name(x, commands)) and
+                     not is_already_done(x, commands, args.out_dir)]
+        if read_sets:
+            print()
+            print('Waiting for ' + str(len(read_sets)) + ' read set' +
+                  ('' if len(read_sets) == 1 else 's') + ' claimed by other workers',
+                  flush=True)
+            time.sleep(min(args.lease_timeout / 2.0, 60.0))
+
+
+def run_read_sets(commands, read_sets, args, quast_batcher=None):
+    if args.jobs == 1 and args.eval_jobs == 0:
+        for read_set in read_sets:
+            assemble_read_set(commands, read_set, args, None, quast_batcher)
+    else:
+        run_concurrent_jobs(commands, read_sets, args, quast_batcher)
+
+
+def run_concurrent_jobs(commands, read_sets, args, quast_batcher=None):
+    """
+    Runs multiple read sets at once, packed into the --max_cores and --max_mem budget. If
+    --eval_jobs is used, evaluations run in their own pool, overlapping with later assemblies.
+    """
+    from unicycler_assembly_tests.scheduler import Job, ResourceScheduler
+    if args.eval_jobs > 0:
+        eval_scheduler = ResourceScheduler(args.eval_jobs, args.eval_jobs, float('inf'))
+        eval_thread = threading.Thread(target=eval_scheduler.run)
+        eval_thread.daemon = True
+        eval_thread.start()
+    else:
+        eval_scheduler, eval_thread = None, None
 
+    job_cores, job_mem = get_job_resources(commands, args)
+    scheduler = ResourceScheduler(args.jobs, args.max_cores, args.max_mem)
+    predicted_mem = False
     for read_set in read_sets:
+        if is_already_done(read_set, commands, args.out_dir):
+            print(read_set.set_name + ': already done')
+            continue
+        _, read_set_mem = get_job_resources(commands, args, read_set)
+        predicted_mem = predicted_mem or read_set_mem != job_mem
+        scheduler.submit(Job(read_set.set_name, assemble_read_set,
+                             (commands, read_set, args, eval_scheduler, quast_batcher),
+                             job_cores, read_set_mem))
+    scheduler.close()
+
+    print()
+    print('Running up to ' + str(args.jobs) + ' jobs at once (' + str(args.max_cores) +
+          ' cores, ' + '%.1f' % args.max_mem + ' GB), each job using ' + str(job_cores) +
+          ' cores and ' + ('its predicted memory' if predicted_mem
+                           else '%.1f' % job_mem + ' GB'), flush=True)
+    if eval_scheduler is not None:
+        print('Evaluating up to ' + str(args.eval_jobs) + ' assemblies at once', flush=True)
+    scheduler.run()
+    failed_jobs = scheduler.failed
+    if eval_scheduler is not None:
+        eval_scheduler.close()
+        eval_thread.join()
+        failed_jobs += eval_scheduler.failed
+    if failed_jobs:
         print()
-        print(bold_yellow_underline('Read set: ' + read_set.set_name))
+        print(red('Failed jobs: ' + ', '.join(x.name for x in failed_jobs)))
+
+
+def get_job_resources(commands, args, read_set=None):
+    """
+    Returns the cores and memory (GB) for each job. Unless --job_mem is given, a job run on its
+    own gets all of the memory and concurrent jobs get a share proportional to their cores. If
+    the read set has a predicted peak memory (and memory isn't a hard limit), concurrent jobs
+    reserve that instead, plus a margin.
+    """
+    job_cores = min(commands.get_thread_count(), args.max_cores)
+    if args.job_mem is not None:
+        job_mem = args.job_mem
+    elif args.jobs == 1:
+        job_mem = args.max_mem
+    elif read_set is not None and read_set.prediction is not None and \
+            read_set.prediction.mem is not None and not args.enforce_mem:
+        job_mem = min(max(read_set.prediction.mem * PREDICTED_MEM_MARGIN, 1.0), args.max_mem)
+    else:
+        job_mem = args.max_mem * job_cores / args.max_cores
+    return job_cores, job_mem
+
+
+def profile_read_sets(commands, read_sets, args):
+    """
+    Gets the read statistics of each read set which isn't done yet (profiling its files in
+    parallel if they haven't been profiled before). Read sets whose _1 and _2 files have
+    different read counts are left out.
+    """
+    from unicycler_assembly_tests.read_profile import get_read_profiles
+    pending = [x for x in read_sets if not is_already_done(x, commands, args.out_dir)]
+    read_filenames = []
+    for read_set in pending:
+        for read_filename in read_set.get_read_filenames():
+            if read_filename not in read_filenames:
+                read_filenames.append(read_filename)
+    profiles = get_read_profiles(read_filenames, args.cache_dir, args.max_cores)
+
+    invalid_read_sets = set()
+    for read_set in pending:
+        read_set.read_profiles = {x: profiles[x] for x in read_set.get_read_filenames()}
+        pair_counts = [profiles[read_set.short_reads_1].read_count,
+                       profiles[read_set.short_reads_2].read_count]
+        if pair_counts[0] != pair_counts[1]:
+            print(red('Skipping ' + read_set.set_name + ': its _1 and _2 files have ' +
+                      str(pair_counts[0]) + ' and ' + str(pair_counts[1]) + ' reads'))
+            invalid_read_sets.add(read_set.set_name)
+    return [x for x in read_sets if x.set_name not in invalid_read_sets]
+
+
+def make_depth_read_sets(sweep_commands, read_sets, args):
+    """
+    Subsamples each read set to each --depth_sweep depth below its own and returns the
+    subsampled read sets (named like the full read set plus '__<depth>x'). All of a read set's
+    files are reduced by the same fraction, so a hybrid read set keeps its ratio of short to
+    long reads. Each read file is only read once, however many subsets are made from it.
+    """
+    from unicycler_assembly_tests.read_profile import get_read_profiles
+    from unicycler_assembly_tests.subsample import subsample_files, format_depth
+    subsample_dir = os.path.join(args.out_dir, 'subsampled_reads')
+    depth_read_sets, tasks = [], OrderedDict()
+    for read_set in read_sets:
+        if not read_set.reference:
+            print(red('No depth sweep for ' + read_set.set_name + ': it has no reference'))
+            continue
+        if read_set.read_profiles is None:  # read sets which are done weren't profiled
+            read_set.read_profiles = get_read_profiles(read_set.get_read_filenames(),
+                                                       args.cache_dir, args.max_cores)
+        reference_length = get_reference_info(read_set.reference,
+                                              args.cache_dir).get_total_length()
+        depth = read_set.get_total_bases() / reference_length if reference_length else 0.0
+        for target_depth in args.depth_sweep:
+            label = format_depth(target_depth)
+            if target_depth >= depth:
+                print(dim('No ' + label + ' subset of ' + read_set.set_name + ': it is only ' +
+                          '%.1f' % depth + 'x'))
+                continue
+            depth_read_set = ReadSet(read_set.set_name + '__' + label, fake=read_set.fake)
+            depth_read_set.reference = read_set.reference
+            subsets = []
+            for read_filename in read_set.get_read_filenames():
+                subsampled_filename = os.path.join(subsample_dir, read_set.set_name, label,
+                                                   os.path.basename(read_filename))
+                depth_read_set.add_read(subsampled_filename)
+                subsets.append((read_filename, subsampled_filename))
+            depth_read_sets.append(depth_read_set)
+            if all(is_already_done(depth_read_set, x, args.out_dir) for x in sweep_commands):
+                continue
+            for read_filename, subsampled_filename in subsets:
+                tasks.setdefault(read_filename, []).append((target_depth / depth,
+                                                            subsampled_filename))
+    subsample_files(tasks.items(), args.max_cores)
+    return depth_read_sets
+
+
+def plan_read_sets(commands, read_sets, args):
+    """
+    Predicts each read set's assembly time and memory from past results (this output directory's
+    results.tsv and any --history tables) and returns the read sets longest first, so the slowest
+    jobs don't start last and leave the campaign waiting on them. Read sets with no prediction go
+    first, as they could be the slowest of all.
+    """
+    from unicycler_assembly_tests.cost_model import load_cost_model
+    cost_model = load_cost_model([os.path.join(args.out_dir, 'results.tsv')] + args.history)
+    if cost_model.row_count == 0:
+        return read_sets
+    for read_set in read_sets:
+        read_set.prediction = cost_model.predict(get_job_features(commands, read_set))
+    return sorted(read_sets, key=lambda x: -x.prediction.time if x.prediction is not None
+                  else float('-inf'))
+
+
+def get_job_features(commands, read_set):
+    from unicycler_assembly_tests.cost_model import JobFeatures
+    if read_set.reference:
+        reference_length = get_reference_info(read_set.reference,
+                                              commands.cache_dir).get_total_length()
+    else:
+        reference_length = None
+    return JobFeatures(commands.get_assembler_name(), commands.get_assembler_setting(),
+                       commands.get_assembler_version(), read_set.get_set_type(),
+                       read_set.fake_illumina_quality(), read_set.fake_long_quality(),
+                       str(commands.get_thread_count()), reference_length)
+
 
-        # Don't bother if the file already exists. This lets us resume crashed/stopped runs
-        # without repeating too much work.
-        _, copied_fasta = get_copied_fasta_name(read_set, commands, args.out_dir)
-        if os.path.isfile(copied_fasta) or os.path.isfile(copied_fasta + '.gz'):
-            print('Already done')
+def get_prediction_str(read_set):
+    if read_set.prediction is None:
+        return ''
+    prediction_str = 'predicted ' + format_duration(read_set.prediction.time)
+    if read_set.prediction.mem is not None:
+        prediction_str += ', ' + '%.1f' % read_set.prediction.mem + ' GB'
+    return dim(' (' + prediction_str + ')')
+
+
+def print_predicted_makespan(commands, read_sets, args):
+    """
+    Prints how long the read sets which aren't done yet should take to assemble, by simulating
+    the scheduler on their predicted times.
+    """
+    from unicycler_assembly_tests.cost_model import predict_makespan
+    pending = [x for x in read_sets if not is_already_done(x, commands, args.out_dir)]
+    predicted = [x for x in pending if x.prediction is not None]
+    if not predicted:
+        return
+    jobs = []
+    for read_set in predicted:
+        job_cores, job_mem = get_job_resources(commands, args, read_set)
+        jobs.append((read_set.prediction.time, job_cores, job_mem))
+    makespan = predict_makespan(jobs, args.jobs, args.max_cores, args.max_mem)
+    print()
+    print('Predicted assembly time for ' + str(len(predicted)) + ' read set' +
+          ('' if len(predicted) == 1 else 's') + ': ' + format_duration(makespan))
+    if len(predicted) < len(pending):
+        unpredicted_count = len(pending) - len(predicted)
+        print(str(unpredicted_count) + ' read set' + ('' if unpredicted_count == 1 else 's') +
+              ' with no similar past results not included')
+
+
+def is_already_done(read_set, commands, out_dir):
+    return all(is_output_done(read_set, x, out_dir)
+               for x in commands.get_output_commands(read_set))
+
+
+def is_output_done(read_set, commands, out_dir):
+    """
+    An output is done once its result is written, or while it is queued (in the output directory)
+    for a batched QUAST run.
+    """
+    from unicycler_assembly_tests.quast_runner import is_quast_queued
+    copied_fasta_name, _ = get_copied_fasta_name(read_set, commands, out_dir)
+    if is_quast_queued(out_dir, copied_fasta_name):
+        return True
+    results_db = get_results_db(out_dir)
+    if results_db is not None:
+        return results_db.is_done(read_set.set_name, commands.get_assembler_name(),
+                                  commands.get_assembler_setting(),
+                                  commands.get_assembler_version(), commands.get_thread_count())
+    done_assemblies = get_done_assemblies(out_dir)
+    return copied_fasta_name in done_assemblies or copied_fasta_name + '.gz' in done_assemblies
+
+
+def get_done_assemblies(out_dir):
+    """
+    Returns the set of 'Assembly FASTA' names in results.tsv's successful rows. An assembly is
+    only done once its row is written (its copied FASTA may already be in the output directory
+    while it waits in memory for evaluation, and it isn't done if the run stops then). The set is
+    cached
+    until the table changes.
+    """
+    results_table = os.path.join(out_dir, 'results.tsv')
+    try:
+        stat = os.stat(results_table)
+    except OSError:
+        return set()
+    table_version = (results_table, stat.st_mtime_ns, stat.st_size)
+    with done_assemblies_lock:
+        if table_version in done_assemblies_cache:
+            return done_assemblies_cache[table_version]
+    done_assemblies = set()
+    with open(results_table, 'rt') as table:
+        headers = table.readline().rstrip('\n').split('\t')
+        for line in table:
+            row = dict(zip(headers, line.rstrip('\n').split('\t')))
+            if row.get('Assembly result') == 'success' and row.get('Assembly FASTA'):
+                done_assemblies.add(row['Assembly FASTA'])
+    with done_assemblies_lock:
+        done_assemblies_cache.clear()
+        done_assemblies_cache[table_version] = done_assemblies
+    return done_assemblies
+
+
+def print_dry_run(commands, read_sets, out_dir):
+    """
+    Shows which read sets are already done and the commands which would be run for the rest,
+    without running anything. The assembler version is only taken from the version cache. If it
+    isn't there, a read set counts as done if any version of this assembler/setting has a
+    successful result.
+    """
+    version = commands.get_assembler_version(probe=False)
+    done_assemblies = get_done_assemblies(out_dir)
+    outputs = commands.get_output_commands()
+    results_db = get_results_db(out_dir)
+    if results_db is not None:
+        done_read_sets = [results_db.get_successful_read_sets(x.get_assembler_name(),
+                                                              x.get_assembler_setting(), version,
+                                                              x.get_thread_count())
+                          for x in outputs]
+
+    print()
+    print(bold_yellow_underline('Dry run: ' + commands.command_filename))
+    print('Assembler: ' + commands.get_assembler_name() + ' ' +
+          (version if version is not None else '(version not cached)') + ', ' +
+          str(commands.get_thread_count()) + ' threads')
+    if len(outputs) > 1:
+        print('Outputs: ' + ', '.join(x.get_assembler_setting() for x in outputs))
+    done_count = 0
+    for read_set in read_sets:
+        done = True  # only if all of the command file's outputs are done
+        for i, output_commands in enumerate(outputs):
+            if output_commands not in commands.get_output_commands(read_set):
+                continue
+            prefix = get_copied_fasta_prefix(read_set, output_commands)
+            if results_db is not None:
+                output_done = read_set.set_name in done_read_sets[i]
+            elif version is not None:
+                copied_fasta_name = prefix + '_' + version + '.fasta'
+                output_done = copied_fasta_name in done_assemblies or \
+                    copied_fasta_name + '.gz' in done_assemblies
+            else:
+                output_done = any(f.startswith(prefix + '_') for f in done_assemblies)
+            done = done and output_done
+        print()
+        if done:
+            done_count += 1
+            print(green('done') + '     ' + str(read_set))
             continue
+        print(red('pending') + '  ' + str(read_set))
+        for command in commands.get_assembly_commands(read_set):
+            print(dim('  ' + command))
 
-        os.makedirs(assembly_dir)
-        assembly_time, assembly_stdout = execute_commands(commands, read_set, assembly_dir)
-        evaluate_results(commands, read_set, assembly_dir, assembly_time, assembly_stdout,
-                         args.out_dir)
-        shutil.rmtree(assembly_dir)
+    print()
+    print(str(len(read_sets)) + ' read sets: ' + str(done_count) + ' done, ' +
+          str(len(read_sets) - done_count) + ' pending', flush=True)
+
+
+def make_assembly_dir(parent_dir):
+    """
+    Each job gets its own temp directory (in the output or scratch directory), so concurrent
+    jobs (in this process or others using the same directory) don't collide.
+    """
+    return tempfile.mkdtemp(prefix='ASSEMBLY_TEMP_' + str(os.getpid()) + '_', dir=parent_dir)
 
 
 def get_arguments():
@@ -92,6 +662,98 @@ def get_arguments():
                         help='Text file containing assembler commands')
     parser.add_argument('--out_dir', type=str, required=True,
                         help='Directory for assembly files and results table')
+    parser.add_argument('--cache_dir', type=str, default=get_default_cache_dir(),
+                        help='Directory for cached data which can be reused between runs '
+                             '(default: ~/.cache/unicycler_assembly_tests)')
+    parser.add_argument('--scratch_dir', type=str, default=None,
+                        help='Fast local directory (e.g. SSD or tmpfs) for assembly temp '
+                             'directories and staged copies of the reads, which are shared by '
+                             'jobs and runs using the same scratch directory')
+    parser.add_argument('--decompress_reads', action='store_true',
+                        help='Decompress reads while staging them to --scratch_dir')
+    parser.add_argument('--clean_scratch', action='store_true',
+                        help='Remove staged reads from --scratch_dir when no job is using them '
+                             '(default: keep them for later runs)')
+    parser.add_argument('--compress_threads', type=int, default=2,
+                        help='Threads for compressing assembly FASTAs and graphs in the '
+                             'background')
+    parser.add_argument('--sample_interval', type=float, default=0.0,
+                        help='If above zero, sample CPU and memory usage of the assembly '
+                             'commands at this interval (seconds) and save the samples alongside '
+                             'the assembly')
+    parser.add_argument('--tee', action='store_true',
+                        help='Print assembler output to the console as well as saving it')
+    parser.add_argument('--command_timeout', type=duration_argument, default=None,
+                        help='Time limit for each command without its own timeout in the '
+                             'command file, e.g. 90m or 2h (default: none)')
+    parser.add_argument('--job_timeout', type=duration_argument, default=None,
+                        help='Time limit for all of a read set\'s commands (default: none)')
+    parser.add_argument('--stall_timeout', type=duration_argument, default=None,
+                        help='Kill a command if it produces no output and uses no CPU for this '
+                             'long (default: never)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Thread count used in place of THREADS in the command file '
+                             '(default: ' + str(DEFAULT_THREADS) + ')')
+    parser.add_argument('--thread_sweep', type=thread_list_argument, default=None,
+                        help='Run each read set at each of these thread counts (comma-separated, '
+                             'e.g. 1,2,4,8,16) and report the speedup and parallel efficiency '
+                             'in thread_scaling.tsv')
+    parser.add_argument('--depth_sweep', type=depth_list_argument, default=None,
+                        help='Also assemble each read set subsampled to these depths (comma-'
+                             'separated, e.g. 10,20,40,80) and write a depth scaling report')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of read sets to assemble at once')
+    parser.add_argument('--max_cores', type=int, default=os.cpu_count(),
+                        help='Total CPU cores available to concurrent jobs (default: all)')
+    parser.add_argument('--max_mem', type=float, default=None,
+                        help='Total memory (GB) available to concurrent jobs (default: all)')
+    parser.add_argument('--job_mem', type=float, default=None,
+                        help='Memory (GB) reserved by each job (default: a share of --max_mem '
+                             'proportional to the job\'s cores)')
+    parser.add_argument('--fast_eval', action='store_true',
+                        help='Only compute contiguity metrics (N50, NG50, etc.) in-process, '
+                             'without running QUAST')
+    parser.add_argument('--quast_batch_size', type=int, default=0,
+                        help='If above zero, run QUAST once per this many finished assemblies '
+                             'which share a reference, gathered in --out_dir from all runs and '
+                             'workers using it (the rest are run at the end of each run)')
+    parser.add_argument('--quast_threads', type=int, default=None,
+                        help='Threads for each QUAST run (default: --max_cores divided by '
+                             '--jobs)')
+    parser.add_argument('--eval_jobs', type=int, default=0,
+                        help='If above zero, evaluate assemblies (QUAST, etc.) in a separate pool '
+                             'of this many single-threaded jobs, so the next assembly can start '
+                             'as soon as the previous one\'s files are harvested')
+    parser.add_argument('--enforce_mem', action='store_true',
+                        help='Make each job\'s memory a hard limit (using a cgroup if possible, '
+                             'otherwise per-process rlimits)')
+    parser.add_argument('--no_result_cache', action='store_false', dest='result_cache',
+                        help='Don\'t reuse (or save) finished assemblies in the result cache in '
+                             '--cache_dir')
+    parser.add_argument('--no_read_profile', action='store_false', dest='read_profile',
+                        help='Don\'t profile the reads (read counts, bases, N50, quality and '
+                             'depth in the results, and checking that read pairs match)')
+    parser.add_argument('--no_step_cache', action='store_false', dest='step_cache',
+                        help='Don\'t reuse (or save) the outputs of commands which declare them '
+                             '(with \'# output=<path>\') in the step cache in --cache_dir')
+    parser.add_argument('--results_backend', type=str, choices=['tsv', 'sqlite'],
+                        default='tsv',
+                        help='Where to keep results: appended to results.tsv, or in an SQLite '
+                             'database (results.sqlite) which results.tsv is exported from at '
+                             'the start and end of each run (default: tsv)')
+    parser.add_argument('--worker', action='store_true',
+                        help='Claim each read set with a lease file before assembling it, so '
+                             'several processes (on any hosts) can share one --out_dir without '
+                             'duplicating work')
+    parser.add_argument('--lease_timeout', type=float, default=300.0,
+                        help='In worker mode, a lease not renewed for this many seconds (e.g. '
+                             'because its worker crashed) can be reclaimed (default: 300)')
+    parser.add_argument('--history', type=str, nargs='+', default=[],
+                        help='Other results tables (e.g. from past campaigns) to predict '
+                             'assembly times from, as well as --out_dir\'s results.tsv')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Only show which read sets are already done and the commands which '
+                             'would be run for the rest, without running anything')
 
     args = parser.parse_args()
 
@@ -108,20 +770,152 @@ def get_arguments():
     args.out_dir = os.path.abspath(args.out_dir)
     if args.ref_dir:
         args.ref_dir = os.path.abspath(args.ref_dir)
+    args.cache_dir = os.path.abspath(args.cache_dir)
+    if args.scratch_dir:
+        args.scratch_dir = os.path.abspath(args.scratch_dir)
+        os.makedirs(args.scratch_dir, exist_ok=True)
+    elif args.decompress_reads or args.clean_scratch:
+        sys.exit('--decompress_reads and --clean_scratch require --scratch_dir')
+    if args.jobs < 1:
+        sys.exit('--jobs must be at least 1')
+    if args.compress_threads < 1:
+        sys.exit('--compress_threads must be at least 1')
+    if args.lease_timeout <= 0.0:
+        sys.exit('--lease_timeout must be positive')
+    if args.threads is not None and args.threads < 1:
+        sys.exit('--threads must be at least 1')
+    if args.thread_sweep:
+        # Sweep runs are for timing, so nothing is restored from the caches.
+        args.result_cache, args.step_cache = False, False
+    if args.depth_sweep and not args.ref_dir:
+        sys.exit('--depth_sweep requires --ref_dir (read depths are relative to the reference)')
+    if args.depth_sweep and not args.read_profile:
+        sys.exit('--depth_sweep can\'t be used with --no_read_profile')
+    from unicycler_assembly_tests.results_db import RESULTS_DB_FILENAME
+    if args.worker and (args.results_backend == 'sqlite' or
+                        os.path.isfile(os.path.join(args.out_dir, RESULTS_DB_FILENAME))):
+        sys.exit('--worker can\'t be used with a results database, as SQLite\'s WAL mode isn\'t '
+                 'safe on shared filesystems like NFS - use a new --out_dir with the tsv '
+                 'backend')
+    if args.quast_threads is None:
+        args.quast_threads = max(1, args.max_cores // args.jobs)
+    if args.max_mem is None:
+        from unicycler_assembly_tests.scheduler import get_total_memory
+        args.max_mem = get_total_memory()
 
     return args
 
 
-def create_results_table(out_dir):
+def thread_list_argument(thread_list_str):
+    try:
+        thread_counts = [int(x) for x in thread_list_str.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid thread counts: ' + thread_list_str)
+    if not thread_counts or min(thread_counts) < 1:
+        raise argparse.ArgumentTypeError('invalid thread counts: ' + thread_list_str)
+    return sorted(set(thread_counts))
+
+
+def depth_list_argument(depth_list_str):
+    try:
+        depths = [float(x) for x in depth_list_str.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid depths: ' + depth_list_str)
+    if not depths or min(depths) <= 0.0:
+        raise argparse.ArgumentTypeError('invalid depths: ' + depth_list_str)
+    return sorted(set(depths))
+
+
+def duration_argument(duration_str):
+    try:
+        return parse_duration(duration_str)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid duration: ' + duration_str)
+
+
+def create_results_table(out_dir, backend='tsv'):
+    """
+    Makes the results table, or checks the existing one (migrating it if it was made by an older
+    version). Once an output directory has a results database, it is always used (with
+    results.tsv exported from it), whatever the backend.
+    """
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir)
     results_table = os.path.join(out_dir, 'results.tsv')
+    headers = list(TestResult().results.keys())
     if os.path.isfile(results_table):
-        return
-    with open(results_table, 'wt') as table:
-        empty_result = TestResult()
-        table.write('\t'.join(list(empty_result.results.keys())))
-        table.write('\n')
+        with open(results_table, 'rt') as table:
+            existing_headers = table.readline().rstrip('\n').split('\t')
+        if existing_headers != headers:
+            migrate_results_table(results_table, headers)
+    else:
+        with open(results_table, 'wt') as table:
+            table.write('\t'.join(headers))
+            table.write('\n')
+
+    results_db = get_results_db(out_dir)
+    if results_db is None and backend == 'sqlite':
+        from unicycler_assembly_tests.results_db import ResultsDatabase, RESULTS_DB_FILENAME
+        results_db = ResultsDatabase(os.path.join(out_dir, RESULTS_DB_FILENAME), headers)
+    if results_db is not None:
+        if not results_db.create():
+            old_table = results_db.migrate()
+            print('Updated ' + results_db.filename + ' to this version\'s columns' +
+                  ('' if old_table is None else ' (the old table, with columns no longer used, '
+                                                'is kept as ' + old_table + ')'), flush=True)
+        if results_db.is_empty():  # results from before the database was used
+            results_db.import_tsv(results_table)
+        results_db.export_tsv(results_table)
+
+
+def migrate_results_table(results_table, headers):
+    """
+    Rewrites a results table made by an older version of assembler_comparison with these headers,
+    moving its values by column name and leaving new columns empty. If the old table has columns
+    which these headers don't, it is first copied to results.tsv.old.
+    """
+    with open(results_table, 'rt') as table:
+        fcntl.flock(table, fcntl.LOCK_EX)
+        if os.fstat(table.fileno()).st_ino != os.stat(results_table).st_ino:
+            return  # another process migrated it first
+        old_headers = table.readline().rstrip('\n').split('\t')
+        if old_headers == headers:
+            return
+        unused_headers = [x for x in old_headers if x not in headers]
+        if unused_headers:
+            shutil.copyfile(results_table, results_table + '.old')
+        temp_fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(results_table),
+                                                  prefix='.results_')
+        with os.fdopen(temp_fd, 'wt') as new_table:
+            new_table.write('\t'.join(headers) + '\n')
+            for line in table:
+                if line.strip():
+                    row = dict(zip(old_headers, line.rstrip('\n').split('\t')))
+                    new_table.write('\t'.join(row.get(x, '') for x in headers) + '\n')
+        os.replace(temp_filename, results_table)
+    print('Updated ' + results_table + ' to this version\'s columns' +
+          ('' if not unused_headers else ' (the old table, with columns no longer used, is '
+                                         'kept as ' + results_table + '.old)'), flush=True)
+
+
+def export_results_table(out_dir):
+    """
+    If there is a results database, brings results.tsv up to date with it.
+    """
+    results_db = get_results_db(out_dir)
+    if results_db is not None:
+        results_db.export_tsv(os.path.join(out_dir, 'results.tsv'))
+
+
+def get_results_db(out_dir):
+    """
+    Returns the output directory's ResultsDatabase, or None if it only has results.tsv.
+    """
+    from unicycler_assembly_tests.results_db import ResultsDatabase, RESULTS_DB_FILENAME
+    db_filename = os.path.join(out_dir, RESULTS_DB_FILENAME)
+    if not os.path.isfile(db_filename):
+        return None
+    return ResultsDatabase(db_filename, TestResult().results.keys())
 
 
 def group_real_reads(read_dir):
@@ -182,60 +976,149 @@ def get_set_name_from_fake_read_filename(read_filename):
     return set_name.split('/')[-1]
 
 
-def execute_commands(commands, read_set, assembly_dir):
-    if read_set.get_set_type() == 'short-only':
-        set_commands = commands.get_short_read_assembly_commands(read_set)
+def execute_commands(commands, read_set, assembly_dir, sample_interval=0.0, memory_limit=None,
+                     tee=False, command_timeout=None, job_timeout=None, stall_timeout=None,
+                     step_cache_dir=None, lease=None):
+    """
+    Runs the read set's commands. Each command is limited to its timeout from the command file
+    (or command_timeout if it has none) and to what is left of job_timeout. A command which
+    times out or stalls is killed, and the remaining commands aren't run. If a step cache
+    directory is given, commands which declare their outputs are restored from the step cache
+    when possible, and saved to it when they succeed. If a lease is given and it is lost, no
+    more commands are run and the run is marked as abandoned.
+    """
+    set_commands = commands.get_assembly_commands(read_set)
+    timeouts = commands.get_command_timeouts(read_set)
+    step_outputs = commands.get_command_outputs(read_set)
+    if step_cache_dir is not None and any(step_outputs):
+        from unicycler_assembly_tests.step_cache import get_step_keys
+        step_keys = get_step_keys(set_commands, read_set.get_read_filenames())
     else:
-        set_commands = commands.get_hybrid_assembly_commands(read_set)
-
-    try:
-        starting_dir = os.getcwd()
-    except FileNotFoundError:
-        starting_dir = assembly_dir
-    os.chdir(assembly_dir)
-
+        step_keys = None
     start_time = time.time()
-    all_stdout = ''
-    for command in set_commands:
-        print(command, flush=True)
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                   shell=True)
-        try:
-            stdout, _ = process.communicate()
-        except (OSError, MemoryError):
-            print('', flush=True)
-            os.chdir(starting_dir)
-            return 0.0, 'Failed with OSError/MemoryError'
-        print('', flush=True)
-        all_stdout += stdout.decode()
-    assembly_time = time.time() - start_time
-
-    os.chdir(starting_dir)
-    return assembly_time, all_stdout
-
+    assembly_run = AssemblyRun()
+    if sample_interval > 0.0:
+        from unicycler_assembly_tests.resource_sampler import ResourceSampler
+        assembly_run.samples_filename = os.path.join(assembly_dir, 'resource_samples.tsv')
+        sampler = ResourceSampler(assembly_run.samples_filename, sample_interval)
+        sampler.start()
+    else:
+        sampler = None
 
-def evaluate_results(commands, read_set, assembly_dir, assembly_time, assembly_stdout, out_dir):
+    # Output goes straight to a compressed log, so it's never all held in memory.
+    assembly_run.log_filename = os.path.join(assembly_dir, 'assembly_output.out.gz')
+    log_file = gzip.open(assembly_run.log_filename, 'wb', compresslevel=6)
+    try:
+        for i, command in enumerate(set_commands):
+            if lease is not None and lease.lost:
+                assembly_run.abandoned = True
+                assembly_run.error = 'Lease lost before command ' + str(i + 1)
+                log_file.write((assembly_run.error + '\n').encode())
+                return assembly_run
+            print(command, flush=True)
+            timeout = timeouts[i] if timeouts[i] is not None else command_timeout
+            if job_timeout is not None:
+                remaining_time = job_timeout - (time.time() - start_time)
+                timeout = remaining_time if timeout is None else min(timeout, remaining_time)
+            if timeout is not None and timeout <= 0.0:
+                assembly_run.timed_out = True
+                assembly_run.error = 'Job timed out after ' + '%.0f' % job_timeout + ' seconds'
+                log_file.write((assembly_run.error + '\n').encode())
+                return assembly_run
+
+            # The step is locked while it runs, so a concurrent job with the same step waits
+            # for it and then restores it from the cache.
+            if step_keys is not None and step_outputs[i]:
+                from unicycler_assembly_tests.step_cache import lock_step, save_step
+                step_lock = lock_step(step_cache_dir, step_keys[i])
+            else:
+                step_lock = None
+            try:
+                if step_lock is not None:
+                    command_result = restore_cached_step(command, step_cache_dir, step_keys[i],
+                                                         assembly_dir, log_file)
+                    if command_result is not None:
+                        assembly_run.command_results.append(command_result)
+                        continue
+                try:
+                    command_result = run_command(command, assembly_dir, sampler, i + 1,
+                                                 memory_limit, log_file, tee, timeout,
+                                                 stall_timeout)
+                except (OSError, MemoryError) as e:
+                    print('', flush=True)
+                    assembly_run.error = 'Failed with ' + type(e).__name__
+                    log_file.write((assembly_run.error + '\n').encode())
+                    return assembly_run
+                print('', flush=True)
+                assembly_run.command_results.append(command_result)
+                if command_result.timeout_reason:
+                    assembly_run.timed_out = True
+                    assembly_run.error = 'Command ' + str(i + 1) + ' ' + \
+                        command_result.timeout_reason
+                    log_file.write((assembly_run.error + '\n').encode())
+                    return assembly_run
+                if step_lock is not None and command_result.exit_code == 0:
+                    save_step(step_cache_dir, step_keys[i], assembly_dir, step_outputs[i],
+                              command_result)
+            finally:
+                if step_lock is not None:
+                    step_lock.close()
+    finally:
+        log_file.close()
+        if sampler is not None:
+            sampler.stop()
+            assembly_run.peak_rss_step = sampler.peak_rss_step
+        if memory_limit is not None:
+            assembly_run.oom_kills = memory_limit.get_oom_kill_count()
+
+    return assembly_run
+
+
+def restore_cached_step(command, step_cache_dir, step_key, assembly_dir, log_file):
+    """
+    If the step cache has this step, its outputs are restored to the assembly directory and a
+    CommandResult for it is returned. The result has the resource use measured when the step
+    originally ran, so the assembly's totals are the same as if it had run again. Otherwise
+    returns None.
+    """
+    from unicycler_assembly_tests.step_cache import restore_step
+    step = restore_step(step_cache_dir, step_key, assembly_dir)
+    if step is None:
+        return None
+    message = 'Restored from step cache: ' + step_key
+    print(message + '\n', flush=True)
+    log_file.write((message + '\n').encode())
+    command_result = CommandResult(command)
+    command_result.exit_code = 0
+    command_result.cached = True
+    command_result.wall_time = step.get('wall_time', 0.0)
+    command_result.user_time = step.get('user_time', 0.0)
+    command_result.sys_time = step.get('sys_time', 0.0)
+    command_result.max_rss = step.get('max_rss', 0)
+    return command_result
+
+
+def harvest_results(commands, read_set, assembly_dir, assembly_run, out_dir, keep_files=()):
+    """
+    Checks the assembly and moves its files (and log) out of the assembly directory (files in
+    keep_files are copied instead). Returns a HarvestedAssembly ready for evaluate_results, or
+    None if there is nothing to evaluate.
+    """
     result = TestResult()
-    result.results['Read set name'] = read_set.set_name
-    result.results['Read set type'] = read_set.get_set_type()
-
-    result.results['Real or fake reads'] = read_set.real_or_fake()
-    result.results['Fake Illumina read quality'] = read_set.fake_illumina_quality()
-    result.results['Fake long read quality'] = read_set.fake_long_quality()
-
-    result.results['Read files'] = read_set.get_read_list_str()
+    set_read_set_columns(result, commands, read_set)
 
     if read_set.reference:
-        result.results['Reference name'] = read_set.get_reference_name()
-        ref_seqs = load_fasta(read_set.reference)
-        lengths = [len(x[1]) for x in ref_seqs]
+        ref_info = get_reference_info(read_set.reference, commands.cache_dir)
+        lengths = ref_info.get_lengths()
         result.results['Reference total length'] = str(sum(lengths))
-        ref_count = len(ref_seqs)
-        result.results['# reference sequences'] = str(len(ref_seqs))
+        ref_count = len(ref_info.records)
+        result.results['# reference sequences'] = str(ref_count)
         result.results['Reference sequence lengths'] = ', '.join([str(x) for x in lengths])
-        result.results['Reference sequence depths'] = ', '.join([str(x[2]) for x in ref_seqs])
-        result.results['Reference sequence circularity'] = ', '.join(['yes' if x[3] else 'no'
-                                                                      for x in ref_seqs])
+        result.results['Reference sequence depths'] = ', '.join([str(x.depth)
+                                                                 for x in ref_info.records])
+        result.results['Reference sequence circularity'] = \
+            ', '.join(['yes' if x.circular else 'no' for x in ref_info.records])
+        result.results['Reference GC (%)'] = '%.2f' % ref_info.get_gc()
         longest_ref = max(lengths)
     else:
         ref_count = 0
@@ -245,25 +1128,36 @@ def evaluate_results(commands, read_set, assembly_dir, assembly_time, assembly_s
     result.results['Assembler setting/output'] = commands.get_assembler_setting()
     result.results['Assembler version'] = commands.get_assembler_version()
 
-    if read_set.get_set_type() == 'short-only':
-        commands_str = '; '.join(commands.get_short_read_assembly_commands(read_set))
-    else:
-        commands_str = '; '.join(commands.get_hybrid_assembly_commands(read_set))
-    result.results['Assembly command(s)'] = commands_str
-
     result.results['Assembly kmer size'] = commands.get_kmer_size()
+    result.results['Threads'] = str(commands.get_thread_count())
+
+    # Resource usage is recorded for failed assemblies too, as it may explain the failure.
+    command_results = assembly_run.command_results
+    result.results['Assembly user CPU time (seconds)'] = '%.1f' % assembly_run.get_user_time()
+    result.results['Assembly system CPU time (seconds)'] = '%.1f' % assembly_run.get_sys_time()
+    result.results['Assembly peak RSS (MB)'] = '%.1f' % (assembly_run.get_max_rss() / 1024)
+    result.results['Assembly exit codes'] = assembly_run.get_exit_codes_str()
+    result.results['Command wall times (seconds)'] = ', '.join('%.1f' % x.wall_time
+                                                               for x in command_results)
+    result.results['Command CPU times (seconds)'] = ', '.join('%.1f' % x.get_cpu_time()
+                                                              for x in command_results)
+    result.results['Command peak RSS (MB)'] = ', '.join('%.1f' % (x.max_rss / 1024)
+                                                        for x in command_results)
+    result.results['Parallel efficiency'] = \
+        '%.3f' % assembly_run.get_parallel_efficiency(commands.get_thread_count())
+    result.results['Peak memory phase'] = assembly_run.get_peak_memory_phase()
+    result.results['Slowest step'] = assembly_run.get_slowest_step()
 
     # Check to see that the final FASTA exists and contains sequence.
     final_fasta = os.path.join(assembly_dir, commands.final_assembly_fasta)
-    if assembly_stdout == 'Failed with OSError':
+    if assembly_run.error:
         failed = True
-        print(red('assembly failed: with OSError'))
+        print(red('assembly failed: ' + assembly_run.error))
     elif not os.path.isfile(final_fasta):
         failed = True
         print(red('assembly failed: ' + final_fasta + ' does not exist'))
     else:
-        seqs = load_fasta(final_fasta)
-        length = sum(len(x[1]) for x in seqs)
+        length = get_fasta_length(final_fasta)
         if length == 0:
             failed = True
             print(red('assembly failed: ' + final_fasta + ' is empty'))
@@ -276,6 +1170,8 @@ def evaluate_results(commands, read_set, assembly_dir, assembly_time, assembly_s
 
     if failed:
         result.results['Assembly result'] = 'fail'
+        result.results['Failure type'] = assembly_run.get_failure_type()
+        print(red('failure type: ' + result.results['Failure type']))
     else:
         result.results['Assembly result'] = 'success'
         print(green('assembly succeeded'))
@@ -288,14 +1184,38 @@ def evaluate_results(commands, read_set, assembly_dir, assembly_time, assembly_s
     # failed, then quit now to avoid making a duplicate result line.
     if (os.path.isfile(assembly_stdout_filename) or
             os.path.isfile(assembly_stdout_filename + '.gz')) and failed:
-        return
-
-    with open(assembly_stdout_filename, 'wt') as assembly_stdout_file:
-        assembly_stdout_file.write(assembly_stdout)
+        if assembly_run.command_results:
+            print(assembly_run.command_results[-1].output_tail)
+        return None
+
+    if os.path.isfile(assembly_stdout_filename):  # an uncompressed log from an older run
+        os.remove(assembly_stdout_filename)
+    assembly_stdout_filename += '.gz'
+    harvest_file(assembly_run.log_filename, assembly_stdout_filename, keep_files)
     print('OUTPUT ->', assembly_stdout_filename)
-
+    if failed and assembly_run.command_results:
+        print(assembly_run.command_results[-1].output_tail)
+
+    if assembly_run.samples_filename and os.path.isfile(assembly_run.samples_filename):
+        copied_samples = os.path.join(out_dir,
+                                      copied_fasta_name.replace('.fasta', '.resources.tsv'))
+        harvest_file(assembly_run.samples_filename, copied_samples, keep_files)
+        print(assembly_run.samples_filename, '->', copied_samples)
+
+    if assembly_run.command_results:
+        steps_filename = os.path.join(out_dir, copied_fasta_name.replace('.fasta', '.steps.tsv'))
+        assembly_run.write_steps_file(steps_filename)
+        print('STEPS ->', steps_filename)
+
+    # The FASTA and graph are moved into the artifact store, which compresses them in the
+    # background. They must be waited for before they are used (see evaluate_results).
+    pending_artifacts = []
     if not failed:
-        shutil.copy(final_fasta, copied_fasta)
+        from unicycler_assembly_tests.artifact_store import get_artifact_store
+        artifact_store = get_artifact_store(out_dir)
+        copied_fasta, future = artifact_store.add(final_fasta, copied_fasta,
+                                                  final_fasta in keep_files)
+        pending_artifacts.append(future)
         print(final_fasta, '->', copied_fasta)
 
         if commands.final_assembly_graph:
@@ -310,34 +1230,198 @@ def evaluate_results(commands, read_set, assembly_dir, assembly_time, assembly_s
                 sys.exit('Error: assembly graph must be gfa or fastg')
             copied_graph_name = copied_fasta_name.replace('.fasta', '.' + extension)
             copied_graph = os.path.join(out_dir, copied_graph_name)
-            shutil.copy(final_graph, copied_graph)
+            copied_graph, future = artifact_store.add(final_graph, copied_graph,
+                                                      final_graph in keep_files)
+            pending_artifacts.append(future)
             print(final_graph, '->', copied_graph)
         else:
             copied_graph = None
 
-        result.results['Assembly time (seconds)'] = '%.1f' % assembly_time
+        result.results['Assembly time (seconds)'] = '%.1f' % assembly_run.get_wall_time()
+        if read_set.read_profiles and assembly_run.get_wall_time() > 0.0:
+            result.results['Throughput (bases/second)'] = \
+                '%.0f' % (read_set.get_total_bases() / assembly_run.get_wall_time())
         result.results['Assembly FASTA'] = copied_fasta.split('/')[-1]
-
         if copied_graph:
             result.results['Assembly graph'] = copied_graph.split('/')[-1]
-            graph = unicycler.assembly_graph.AssemblyGraph(copied_graph, 0)
-            dead_ends = graph.total_dead_end_count()
-            result.results['Dead ends'] = dead_ends
-            try:
-                result.results['Percent dead ends'] = '%.2f' % (100.0 * dead_ends /
-                                                                len(graph.segments))
-            except ZeroDivisionError:
-                pass
+    else:
+        copied_fasta, copied_graph = None, None
 
-        run_quast(copied_fasta, read_set, out_dir, result)
+    harvested = HarvestedAssembly(result, read_set, failed, copied_fasta, copied_graph,
+                                  ref_count, longest_ref, out_dir)
+    harvested.pending_artifacts = pending_artifacts
+    return harvested
 
-        if read_set.reference:
-            # Get total misassemblies in addition to extensive/local.
-            extensive_misassemblies = int(result.results['# misassemblies'])
-            local_misassemblies = int(result.results['# local misassemblies'])
-            total_misassemblies = extensive_misassemblies + local_misassemblies
-            result.results['Total misassemblies'] = str(total_misassemblies)
 
+def harvest_file(source, dest, keep_files=()):
+    if source in keep_files:
+        shutil.copyfile(source, dest)
+    else:
+        shutil.move(source, dest)
+
+
+def set_read_set_columns(result, commands, read_set):
+    """
+    Fills in the columns which depend on where the read set is (not just on its contents).
+    """
+    result.results['Read set name'] = read_set.set_name
+    result.results['Read set type'] = read_set.get_set_type()
+    result.results['Real or fake reads'] = read_set.real_or_fake()
+    result.results['Fake Illumina read quality'] = read_set.fake_illumina_quality()
+    result.results['Fake long read quality'] = read_set.fake_long_quality()
+    result.results['Read files'] = read_set.get_read_list_str()
+    if read_set.reference:
+        result.results['Reference name'] = read_set.get_reference_name()
+    if read_set.read_profiles:
+        set_read_profile_columns(result, read_set, commands.cache_dir)
+    result.results['Assembly command(s)'] = '; '.join(commands.get_assembly_commands(read_set))
+
+
+def set_read_profile_columns(result, read_set, cache_dir=None):
+    profiles = read_set.read_profiles
+    short_profiles = [profiles[read_set.short_reads_1], profiles[read_set.short_reads_2]]
+    result.results['Short read pairs'] = str(short_profiles[0].read_count)
+    result.results['Short read bases'] = str(sum(x.base_count for x in short_profiles))
+    result.results['Short read N50'] = str(max(x.n50 for x in short_profiles))
+    result.results['Short read mean quality'] = '%.2f' % get_mean_quality(short_profiles)
+    if read_set.long_reads:
+        long_profile = profiles[read_set.long_reads]
+        result.results['Long reads'] = str(long_profile.read_count)
+        result.results['Long read bases'] = str(long_profile.base_count)
+        result.results['Long read N50'] = str(long_profile.n50)
+        result.results['Long read mean quality'] = '%.2f' % long_profile.mean_quality
+    if read_set.reference:
+        reference_length = get_reference_info(read_set.reference, cache_dir).get_total_length()
+        if reference_length:
+            result.results['Read depth'] = '%.1f' % (read_set.get_total_bases() /
+                                                     reference_length)
+
+
+def get_mean_quality(profiles):
+    """
+    The mean base quality of several read files together.
+    """
+    base_count = sum(x.base_count for x in profiles)
+    if base_count == 0:
+        return 0.0
+    return sum(x.mean_quality * x.base_count for x in profiles) / base_count
+
+
+def get_cache_key(commands, read_set, fast_eval):
+    from unicycler_assembly_tests.result_cache import get_result_cache_key
+    read_files = read_set.get_read_filenames()
+    assembler_details = [commands.get_assembler_name(), commands.get_assembler_setting(),
+                         commands.get_assembler_version(), commands.final_assembly_fasta,
+                         commands.final_assembly_graph or '']
+    return get_result_cache_key(read_files, read_set.reference,
+                                commands.get_assembly_commands(read_set), assembler_details,
+                                'fast' if fast_eval else 'quast')
+
+
+def restore_cached_results(outputs, read_set, cache_keys, out_dir):
+    """
+    If the result cache has all of the assembly's outputs, they are restored. Returns whether they
+    were. An assembly with only some outputs cached is run again, so none are restored.
+    """
+    from unicycler_assembly_tests.result_cache import has_cached_result
+    if not all(has_cached_result(x.cache_dir, y) for x, y in zip(outputs, cache_keys)):
+        return False
+    return all([restore_cached_result(x, read_set, y, out_dir)
+                for x, y in zip(outputs, cache_keys)])
+
+
+def restore_cached_result(commands, read_set, cache_key, out_dir):
+    """
+    If the result cache has this assembly, its files are copied to the output directory and its
+    result is saved to the results table. Returns whether it was found.
+    """
+    from unicycler_assembly_tests.result_cache import load_cached_result
+    copied_fasta_name, _ = get_copied_fasta_name(read_set, commands, out_dir)
+    file_prefix = copied_fasta_name[:-len('fasta')]
+    cached_results = load_cached_result(commands.cache_dir, cache_key, out_dir, file_prefix)
+    if cached_results is None:
+        return False
+    result = TestResult()
+    for column, value in cached_results.items():
+        if column in result.results:
+            result.results[column] = value
+    for column in ('Assembly FASTA', 'Assembly graph'):
+        result.results[column] = get_restored_filename(result.results[column], file_prefix,
+                                                       out_dir)
+    set_read_set_columns(result, commands, read_set)
+    write_result(result, out_dir)
+    return True
+
+
+def get_restored_filename(cached_filename, file_prefix, out_dir):
+    """
+    A cached result names its files after the read set it was made for, which may have since been
+    renamed or moved. This returns the name of the same file as just restored with this read
+    set's prefix (the longest ending of the cached name which exists with the new prefix).
+    """
+    parts = cached_filename.split('.')
+    for i in range(1, len(parts)):
+        restored_filename = file_prefix + '.'.join(parts[i:])
+        if os.path.isfile(os.path.join(out_dir, restored_filename)):
+            return restored_filename
+    return ''
+
+
+def evaluate_results(harvested, quast_threads=None, fast_eval=False, quast_batcher=None):
+    """
+    Analyses the assembly graph, runs QUAST and saves the result to the results table. With
+    fast_eval, only contiguity metrics are computed (in-process) instead of running QUAST. If a
+    QuastBatcher is given, the assembly waits to be run through QUAST with others that share its
+    reference, and the batcher then finishes the evaluation.
+    """
+    result = harvested.result
+    read_set = harvested.read_set
+    copied_fasta, copied_graph = harvested.copied_fasta, harvested.copied_graph
+    for future in harvested.pending_artifacts:
+        future.result()
+
+    if not harvested.failed:
+        if copied_graph:
+            from unicycler_assembly_tests.graph_stats import get_graph_stats
+            graph_stats = get_graph_stats(copied_graph)
+            result.results['Dead ends'] = str(graph_stats.dead_ends)
+            if graph_stats.segment_count:
+                result.results['Percent dead ends'] = '%.2f' % graph_stats.get_percent_dead_ends()
+            result.results['Graph segments'] = str(graph_stats.segment_count)
+            result.results['Graph total length'] = str(graph_stats.total_length)
+            result.results['Graph connected components'] = str(graph_stats.connected_components)
+            result.results['Graph circular components'] = str(graph_stats.circular_components)
+
+        if fast_eval:
+            from unicycler_assembly_tests.contiguity import get_contiguity_metrics
+            reference_length = int(result.results['Reference total length'] or 0)
+            for metric, value in get_contiguity_metrics(copied_fasta, reference_length).items():
+                if metric in result.results:
+                    result.results[metric] = value
+        elif quast_batcher is not None:
+            # Once queued in the output directory, the assembly counts as done, so its lease
+            # isn't held while it waits for the rest of its batch.
+            quast_batcher.queue(harvested.get_queue_record())
+            if harvested.lease is not None:
+                harvested.lease.release()
+            quast_batcher.run_full_batch(harvested.reference)
+            return
+        else:
+            from unicycler_assembly_tests.quast_runner import run_quast
+            run_quast(copied_fasta, read_set, harvested.out_dir, result, quast_threads)
+
+    finish_evaluation(harvested, fast_eval)
+
+
+def finish_evaluation(harvested, fast_eval=False):
+    """
+    Adds the metrics derived from QUAST's results and saves the result to the results table.
+    """
+    result = harvested.result
+    ref_count, longest_ref = harvested.ref_count, harvested.longest_ref
+
+    if not harvested.failed:
+        if harvested.reference:
             # The assembly is considered complete if the number of contigs matches the reference
             # contig count and the largest contigs matches the largest reference to 10%.
             count_match = (ref_count == int(result.results['# contigs']))
@@ -353,6 +1437,14 @@ def evaluate_results(commands, read_set, assembly_dir, assembly_time, assembly_s
                 complete = 'no'
             result.results['Complete'] = complete
 
+        # The remaining metrics need QUAST's alignments to the reference.
+        if harvested.reference and not fast_eval:
+            # Get total misassemblies in addition to extensive/local.
+            extensive_misassemblies = int(result.results['# misassemblies'])
+            local_misassemblies = int(result.results['# local misassemblies'])
+            total_misassemblies = extensive_misassemblies + local_misassemblies
+            result.results['Total misassemblies'] = str(total_misassemblies)
+
             # To be classed as 'Structurally perfect', the assembly needs no mistakes and nothing
             # extra (mismatches and small indels are still okay).
             unaligned_length = int(result.results['Unaligned length'])
@@ -375,53 +1467,71 @@ def evaluate_results(commands, read_set, assembly_dir, assembly_time, assembly_s
                 completely_perfect = 'no'
             result.results['Completely perfect'] = completely_perfect
 
+    write_result(result, harvested.out_dir)
+    if harvested.lease is not None:
+        if harvested.failed:
+            harvested.lease.mark_failed()
+        harvested.lease.release()
+    if harvested.cache_key is not None and not harvested.failed:
+        from unicycler_assembly_tests.result_cache import save_cached_result
+        file_prefix = os.path.basename(harvested.copied_fasta).split('.fasta')[0] + '.'
+        save_cached_result(harvested.cache_dir, harvested.cache_key, result.results,
+                           harvested.out_dir, file_prefix)
+    print()
+
+
+def load_queued_assembly(record):
+    """
+    Makes a HarvestedAssembly from its record in the QUAST queue (see get_queue_record), which may
+    have been queued by another run.
+    """
+    result = TestResult()
+    result.results.update((x, y) for x, y in record['results'].items() if x in result.results)
+    harvested = HarvestedAssembly(result, None, False, record['fasta'], None, record['ref_count'],
+                                  record['longest_ref'], record['out_dir'])
+    harvested.reference = record['reference']
+    harvested.cache_dir, harvested.cache_key = record['cache_dir'], record['cache_key']
+    return harvested
+
+
+def write_result(result, out_dir):
+    """
+    Appends one line to the results table. The whole line is written under an exclusive lock, so
+    concurrent jobs and processes can't interleave their lines. If there is a results database,
+    the result goes there instead (replacing any earlier result for the same assembly) and the
+    table is exported from it at the end of the run.
+    """
+    results_db = get_results_db(out_dir)
+    if results_db is not None:
+        results_db.write_result(result.results)
+        return
     results_line = '\t'.join([str(x) for x in result.results.values()]) + '\n'
     results_table = os.path.join(out_dir, 'results.tsv')
     with open(results_table, 'at') as table:
         fcntl.flock(table, fcntl.LOCK_EX)
         table.write(results_line)
+        table.flush()
         fcntl.flock(table, fcntl.LOCK_UN)
-    print()
 
 
 def get_copied_fasta_name(read_set, commands, out_dir):
-
-    copied_fasta_name = read_set.set_name + '__' + commands.get_assembler_name()
-    setting = commands.get_assembler_setting()
-    if setting:
-        copied_fasta_name += '_' + setting
+    copied_fasta_name = get_copied_fasta_prefix(read_set, commands)
     copied_fasta_name += '_' + commands.get_assembler_version() + '.fasta'
     copied_fasta = os.path.join(out_dir, copied_fasta_name)
     return copied_fasta_name, copied_fasta
 
 
-def run_quast(fasta, read_set, out_dir, result):
-    quast_dir = os.path.join(out_dir, 'QUAST_TEMP_' + str(os.getpid()))
-
-    quast_command = ['quast.py', fasta]
-
-    if read_set.reference:
-        quast_command += ['-R', read_set.reference]
-
-    quast_command += ['-o', quast_dir,
-                      '-l', '"' + read_set.set_name.replace(',', '') + '"',
-                      '--no-plots', '--strict-NA']
-    print()
-    print(' '.join(quast_command))
-    process = subprocess.Popen(quast_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    _, _ = process.communicate()
-
-    with open(os.path.join(quast_dir, 'report.tsv'), 'rt') as quast_report:
-        for line in quast_report:
-            line_parts = line.strip().split('\t')
-            if line_parts[0] == 'Assembly':  # header line
-                continue
-            if not line_parts:
-                continue
-            if line_parts[0] in result.results:
-                result.results[line_parts[0]] = line_parts[1]
-
-    shutil.rmtree(quast_dir)
+def get_copied_fasta_prefix(read_set, commands):
+    """
+    The copied FASTA's name, up to (but not including) the assembler version.
+    """
+    prefix = read_set.set_name + '__' + commands.get_assembler_name()
+    setting = commands.get_assembler_setting()
+    if setting:
+        prefix += '_' + setting
+    if commands.thread_sweep:
+        prefix += '_' + str(commands.threads) + 't'
+    return prefix
 
 
 END_FORMATTING = '\033[0m'
@@ -449,6 +1559,10 @@ def green(text):
     return GREEN + text + END_FORMATTING
 
 
+def dim(text):
+    return DIM + text + END_FORMATTING
+
+
 class ReadSet(object):
     def __init__(self, set_name, fake=False):
         self.set_name = set_name
@@ -457,11 +1571,20 @@ class ReadSet(object):
         self.long_reads = None
         self.reference = None
         self.fake = fake
+        self.prediction = None  # from the cost model, if there are similar past results
+        self.read_profiles = None  # read filename to ReadProfile, once profiled
 
     def __repr__(self):
         return self.set_name + ' (' + self.get_set_type() + '): ' + self.get_read_list_str() + \
             ', reference: ' + self.get_reference_name()
 
+    def get_read_filenames(self):
+        return [x for x in [self.short_reads_1, self.short_reads_2, self.long_reads]
+                if x is not None]
+
+    def get_total_bases(self):
+        return sum(x.base_count for x in self.read_profiles.values())
+
     def get_read_list_str(self):
         read_files = [self.short_reads_1, self.short_reads_2, self.long_reads]
         return ', '.join(x.split('/')[-1] for x in read_files if x is not None)
@@ -508,12 +1631,12 @@ class ReadSet(object):
     def fake_illumina_quality(self):
         if not self.fake:
             return ''
-        return self.short_reads_1.split('_illumina')[0].split('_')[-1]
+        return os.path.basename(self.short_reads_1).split('_illumina')[0].split('_')[-1]
 
     def fake_long_quality(self):
         if not self.fake or not self.long_reads:
             return ''
-        return self.long_reads.split('_long')[0].split('_')[-1]
+        return os.path.basename(self.long_reads).split('_long')[0].split('_')[-1]
 
 
 class FakeReadSet(object):
@@ -581,15 +1704,41 @@ class FakeReadSet(object):
         return sorted_read_sets
 
 
+def get_line_directives(line):
+    """
+    Returns a dictionary of the key=value settings in a command file line's comment, e.g.
+    {'timeout': '2h'} for 'spades.py ... # timeout=2h'.
+    """
+    if '#' not in line:
+        return {}
+    directives = {}
+    for part in line.split('#', 1)[1].split():
+        if '=' in part:
+            key, value = part.split('=', 1)
+            directives[key] = value
+    return directives
+
+
 class Commands(object):
-    def __init__(self, command_filename):
+    def __init__(self, command_filename, cache_dir=None, threads=None):
         self.short_read_assembly_commands = []
         self.hybrid_assembly_commands = []
+        self.short_read_command_timeouts = []
+        self.hybrid_command_timeouts = []
+        self.short_read_command_outputs = []
+        self.hybrid_command_outputs = []
         self.final_assembly_fasta = None
         self.final_assembly_graph = None
         self.command_filename = command_filename.split('/')[-1]
-
-        final_assembly_files = []
+        self.cache_dir = cache_dir
+        self.assembler_setting = None
+        self.assembler_version = None
+        self.outputs = []  # (setting, FASTA, graph, read set type) for each final files section
+        self.output_commands = None
+        self.threads = threads if threads is not None else DEFAULT_THREADS  # for THREADS
+        self.thread_sweep = False  # whether copied files are named by thread count
+
+        final_assembly_files = []  # (setting, read set type, files) for each section
         mode = None
         with open(command_filename, 'rt') as command_file:
             for line in command_file:
@@ -599,38 +1748,98 @@ class Commands(object):
                     mode = 'SHORT'
                 elif line == '# Hybrid assembly commands':
                     mode = 'HYBRID'
-                elif line == '# Final assembly files':
+                elif line == '# Final assembly files' or \
+                        line.startswith('# Final assembly files:'):
+                    # A command file can have several named outputs from the same commands,
+                    # e.g. '# Final assembly files: contigs' and '# Final assembly files:
+                    # scaffolds'. Each is harvested and evaluated as its own result. An output
+                    # can be limited to one read set type, e.g. 'before_rr (short-only)'.
                     mode = 'FINAL'
+                    setting, set_type = None, None
+                    if ':' in line:
+                        setting = line.split(':', 1)[1].strip()
+                        if setting.endswith(')') and ' (' in setting:
+                            setting, set_type = setting[:-1].split(' (', 1)
+                    final_assembly_files.append((setting, set_type, []))
                 elif not line:
                     mode = None
                 else:
+                    # A command can set its own time limit in a comment, e.g. '# timeout=2h'.
+                    timeout = get_line_directives(line).get('timeout')
+                    if timeout is not None:
+                        try:
+                            timeout = parse_duration(timeout)
+                        except ValueError:
+                            sys.exit('Bad timeout in command file: ' + line)
+
+                    # A command can declare its outputs (relative to the assembly directory),
+                    # e.g. '# output=spades_assembly', which makes it a cacheable step.
+                    outputs = get_line_directives(line).get('output')
+                    outputs = outputs.split(',') if outputs else []
+                    if any(os.path.isabs(x) or '..' in x.split('/') for x in outputs):
+                        sys.exit('Bad output in command file: ' + line)
                     if mode == 'SHORT':
                         self.short_read_assembly_commands.append(cleaned_line)
+                        self.short_read_command_timeouts.append(timeout)
+                        self.short_read_command_outputs.append(outputs)
                     if mode == 'HYBRID':
                         self.hybrid_assembly_commands.append(cleaned_line)
+                        self.hybrid_command_timeouts.append(timeout)
+                        self.hybrid_command_outputs.append(outputs)
                     if mode == 'FINAL':
-                        final_assembly_files.append(cleaned_line)
+                        final_assembly_files[-1][2].append(cleaned_line)
 
         short_or_hybrid = (bool(self.short_read_assembly_commands) or
                            bool(self.hybrid_assembly_commands))
         if not short_or_hybrid or not final_assembly_files:
             sys.exit('Bad command file')
+        settings = [x[0] for x in final_assembly_files]
+        if len(settings) > 1 and (None in settings or len(set(settings)) < len(settings)):
+            sys.exit('Bad command file: each final assembly files section needs its own name')
 
-        self.final_assembly_fasta = [x for x in final_assembly_files
-                                     if x.endswith('.fasta') or x.endswith('.fa')][0]
-        try:
-            self.final_assembly_graph = [x for x in final_assembly_files
-                                         if x.endswith('.gfa') or x.endswith('.fastg')][0]
-        except IndexError:
-            pass
+        for setting, set_type, files in final_assembly_files:
+            try:
+                fasta = [x for x in files if x.endswith('.fasta') or x.endswith('.fa')][0]
+            except IndexError:
+                sys.exit('Bad command file')
+            try:
+                graph = [x for x in files if x.endswith('.gfa') or x.endswith('.fastg')][0]
+            except IndexError:
+                graph = None
+            self.outputs.append((setting, fasta, graph, set_type))
+        self.assembler_setting, self.final_assembly_fasta, self.final_assembly_graph = \
+            self.outputs[0][:3]
+
+    def get_output_commands(self, read_set=None):
+        """
+        Returns a Commands for each of the command file's outputs (just this one if there is only
+        one), or only those which apply to the read set if one is given. They share the assembly
+        commands but each has its own final files and setting.
+        """
+        if self.output_commands is None:
+            if len(self.outputs) == 1:
+                self.output_commands = [self]
+            else:
+                self.output_commands = []
+                for output in self.outputs:
+                    output_commands = copy.copy(self)
+                    output_commands.assembler_setting, output_commands.final_assembly_fasta, \
+                        output_commands.final_assembly_graph = output[:3]
+                    output_commands.outputs = [output]
+                    output_commands.output_commands = [output_commands]
+                    self.output_commands.append(output_commands)
+        if read_set is None:
+            return self.output_commands
+        return [x for x in self.output_commands
+                if x.outputs[0][3] is None or x.outputs[0][3] == read_set.get_set_type()]
 
     def get_short_read_assembly_commands(self, read_set):
         substituted_commands = []
 
         if read_set.reference:
-            ref_seqs = load_fasta(read_set.reference)
-            expected_linear_seqs = sum(0 if x[3] else 1 for x in ref_seqs)
-            total_ref_length = sum(len(x[1]) for x in ref_seqs)
+            ref_info = get_reference_info(read_set.reference, self.cache_dir)
+            expected_linear_seqs = ref_info.get_expected_linear_seqs()
+            total_ref_length = ref_info.get_total_length()
         else:
             expected_linear_seqs = 0
             total_ref_length = 5000000
@@ -640,18 +1849,45 @@ class Commands(object):
             line = line.replace('SHORT_READS_1', read_set.short_reads_1)
             line = line.replace('SHORT_READS_2', read_set.short_reads_2)
             line = line.replace('GENOME_SIZE', str(total_ref_length))
+            line = line.replace('THREADS', str(self.threads))
             if assembler_name == 'Unicycler' and expected_linear_seqs:
                 line += ' --expected_linear_seqs ' + str(expected_linear_seqs)
             substituted_commands.append(line)
 
         return substituted_commands
 
+    def get_assembly_commands(self, read_set):
+        if read_set.get_set_type() == 'short-only':
+            return self.get_short_read_assembly_commands(read_set)
+        else:
+            return self.get_hybrid_assembly_commands(read_set)
+
+    def get_command_timeouts(self, read_set):
+        """
+        Returns the time limit (seconds, or None) set in the command file for each of the read
+        set's commands.
+        """
+        if read_set.get_set_type() == 'short-only':
+            return self.short_read_command_timeouts
+        else:
+            return self.hybrid_command_timeouts
+
+    def get_command_outputs(self, read_set):
+        """
+        Returns the outputs declared in the command file for each of the read set's commands
+        (empty lists for commands which don't declare any).
+        """
+        if read_set.get_set_type() == 'short-only':
+            return self.short_read_command_outputs
+        else:
+            return self.hybrid_command_outputs
+
     def get_hybrid_assembly_commands(self, read_set):
         substituted_commands = []
 
-        ref_seqs = load_fasta(read_set.reference)
-        expected_linear_seqs = sum(0 if x[3] else 1 for x in ref_seqs)
-        total_ref_length = sum(len(x[1]) for x in ref_seqs)
+        ref_info = get_reference_info(read_set.reference, self.cache_dir)
+        expected_linear_seqs = ref_info.get_expected_linear_seqs()
+        total_ref_length = ref_info.get_total_length()
         assembler_name = self.get_assembler_name()
 
         for line in self.hybrid_assembly_commands:
@@ -659,6 +1895,7 @@ class Commands(object):
             line = line.replace('SHORT_READS_2', read_set.short_reads_2)
             line = line.replace('LONG_READS', read_set.long_reads)
             line = line.replace('GENOME_SIZE', str(total_ref_length))
+            line = line.replace('THREADS', str(self.threads))
             if assembler_name == 'Unicycler' and expected_linear_seqs:
                 line += ' --expected_linear_seqs ' + str(expected_linear_seqs)
             substituted_commands.append(line)
@@ -685,6 +1922,11 @@ class Commands(object):
             return ''
 
     def get_assembler_setting(self):
+        if self.assembler_setting is None:
+            self.assembler_setting = self.find_assembler_setting()
+        return self.assembler_setting
+
+    def find_assembler_setting(self):
         """
         Returns contigs/scaffolds for SPAdes and ABySS, and conservative/normal/bold for Unicycler.
         """
@@ -741,7 +1983,33 @@ class Commands(object):
         else:
             return ''
 
-    def get_assembler_version(self):
+    def get_assembler_version(self, probe=True):
+        """
+        Versions are remembered for this instance and cached on disk (keyed by the probed
+        program's path and modification time), as probing them can be slow. If probe is False,
+        only the cache is used and None is returned if the version isn't there.
+        """
+        if self.assembler_version is None:
+            cache_key = get_version_cache_key(self.get_version_probe_program())
+            self.assembler_version = get_cached_version(self.cache_dir, cache_key)
+            if self.assembler_version is None and probe:
+                self.assembler_version = self.probe_assembler_version()
+                save_cached_version(self.cache_dir, cache_key, self.assembler_version)
+        return self.assembler_version
+
+    def get_version_probe_program(self):
+        """
+        Returns the program which probe_assembler_version runs to find the version.
+        """
+        assembler_name = self.get_assembler_name()
+        if assembler_name == 'ABySS':
+            return 'abyss-pe'
+        program = self.get_assembler_program()
+        if assembler_name == 'npScarf':
+            program = program.replace('jsa.np.gapcloser', 'jsa').replace('jsa.np.npscarf', 'jsa')
+        return program
+
+    def probe_assembler_version(self):
         assembler_name = self.get_assembler_name()
         if assembler_name == 'Unicycler':
             version_command = self.get_assembler_program() + ' --version'
@@ -802,6 +2070,34 @@ class Commands(object):
             all_out = stdout.decode() + ' ' + stderr.decode()
             return all_out.split('Version ')[1].split(',')[0]
 
+    def get_thread_count(self):
+        """
+        Returns the number of threads the assembler was told to use (the largest value found in
+        options like --threads 8, -t8, j=8 or maxThreads=8), or 1 if none is given.
+        """
+        thread_counts = [1]
+        thread_option = re.compile(r'(?:--threads[ =]|(?<!\S)-t ?|\bj=|maxThreads=)(\d+)\b')
+        for line in self.short_read_assembly_commands + self.hybrid_assembly_commands:
+            line = line.replace('THREADS', str(self.threads))
+            for match in thread_option.finditer(line):
+                thread_counts.append(int(match.group(1)))
+        return max(thread_counts)
+
+    def uses_threads_placeholder(self):
+        return any('THREADS' in x for x in
+                   self.short_read_assembly_commands + self.hybrid_assembly_commands)
+
+    def with_threads(self, threads, sweep=False):
+        """
+        Returns a copy of these commands with THREADS set to the given count. In a thread sweep,
+        the copied files are also named by the thread count, so each level has its own.
+        """
+        commands = copy.copy(self)
+        commands.threads = threads
+        commands.thread_sweep = sweep
+        commands.output_commands = None
+        return commands
+
     def get_kmer_size(self):
         assembler_name = self.get_assembler_name()
         if assembler_name == 'Unicycler':
@@ -822,6 +2118,37 @@ class Commands(object):
         return ''
 
 
+class HarvestedAssembly(object):
+    """
+    An assembly whose files have been harvested from its assembly directory, waiting to be
+    evaluated.
+    """
+    def __init__(self, result, read_set, failed, copied_fasta, copied_graph, ref_count,
+                 longest_ref, out_dir):
+        self.result = result
+        self.read_set = read_set
+        self.failed = failed
+        self.copied_fasta = copied_fasta
+        self.copied_graph = copied_graph
+        self.ref_count = ref_count
+        self.longest_ref = longest_ref
+        self.out_dir = out_dir
+        self.reference = read_set.reference if read_set is not None else None
+        self.cache_dir = None
+        self.cache_key = None
+        self.lease = None
+        self.pending_artifacts = []
+
+    def get_queue_record(self):
+        """
+        What a batched QUAST run needs to finish this assembly's evaluation, for the QUAST queue.
+        """
+        return OrderedDict([('fasta', self.copied_fasta), ('reference', self.reference),
+                            ('ref_count', self.ref_count), ('longest_ref', self.longest_ref),
+                            ('out_dir', self.out_dir), ('cache_dir', self.cache_dir),
+                            ('cache_key', self.cache_key), ('results', self.result.results)])
+
+
 class TestResult(object):
     def __init__(self):
         self.results = OrderedDict()
@@ -831,6 +2158,15 @@ class TestResult(object):
         self.results['Fake Illumina read quality'] = ''
         self.results['Fake long read quality'] = ''
         self.results['Read files'] = ''
+        self.results['Short read pairs'] = ''
+        self.results['Short read bases'] = ''
+        self.results['Short read N50'] = ''
+        self.results['Short read mean quality'] = ''
+        self.results['Long reads'] = ''
+        self.results['Long read bases'] = ''
+        self.results['Long read N50'] = ''
+        self.results['Long read mean quality'] = ''
+        self.results['Read depth'] = ''
         self.results['Reference name'] = ''
         self.results['Reference total length'] = ''
         self.results['# reference sequences'] = ''
@@ -842,9 +2178,23 @@ class TestResult(object):
         self.results['Assembler setting/output'] = ''
         self.results['Assembler version'] = ''
         self.results['Assembly command(s)'] = ''
+        self.results['Cache key'] = ''
         self.results['Assembly kmer size'] = ''
+        self.results['Threads'] = ''
         self.results['Assembly result'] = ''
+        self.results['Failure type'] = ''
         self.results['Assembly time (seconds)'] = ''
+        self.results['Throughput (bases/second)'] = ''
+        self.results['Assembly user CPU time (seconds)'] = ''
+        self.results['Assembly system CPU time (seconds)'] = ''
+        self.results['Assembly peak RSS (MB)'] = ''
+        self.results['Assembly exit codes'] = ''
+        self.results['Command wall times (seconds)'] = ''
+        self.results['Command CPU times (seconds)'] = ''
+        self.results['Command peak RSS (MB)'] = ''
+        self.results['Parallel efficiency'] = ''
+        self.results['Peak memory phase'] = ''
+        self.results['Slowest step'] = ''
         self.results['Assembly FASTA'] = ''
         self.results['Assembly graph'] = ''
         self.results['# contigs (>= 0 bp)'] = ''
@@ -896,6 +2246,10 @@ class TestResult(object):
         self.results['LGA75'] = ''
         self.results['Dead ends'] = ''
         self.results['Percent dead ends'] = ''
+        self.results['Graph segments'] = ''
+        self.results['Graph total length'] = ''
+        self.results['Graph connected components'] = ''
+        self.results['Graph circular components'] = ''
         self.results['Complete'] = ''
         self.results['Structurally perfect'] = ''
         self.results['Completely perfect'] = ''
@@ -0,0 +1,334 @@
+"""
+Functions for running assembly commands and measuring the resources they use.
+
+Each command is run through the shell and reaped with os.wait4, which gives the CPU time of the
+command's whole process tree (the shell and every descendant it waited for). wait4's peak memory
+is only that of the largest single process, so a command's peak RSS instead comes from summing
+the memory of all its processes over time (from the resource sampler if there is one, otherwise
+from a ProcessTreeMonitor), with wait4's value as a floor for commands too short to be caught.
+Command output is streamed to a log file as it is produced, and only the last few lines are kept
+in memory.
+
+Each command runs in its own process group, which is killed as a unit if the command times out
+or stalls, and (via the signal handlers) if this process is terminated.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import collections
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+TAIL_LINE_COUNT = 200
+TAIL_LINE_LENGTH = 1000
+
+OUT_OF_MEMORY_MESSAGES = ['MemoryError', 'std::bad_alloc', 'Cannot allocate memory',
+                          'OutOfMemoryError', 'out of memory', 'Out of memory']
+
+# Process groups of the commands currently running (in any thread).
+running_process_groups = set()
+running_process_groups_lock = threading.Lock()
+
+
+class CommandResult(object):
+    def __init__(self, command):
+        self.command = command
+        self.exit_code = None  # negative values mean the command was killed by that signal
+        self.wall_time = 0.0
+        self.user_time = 0.0
+        self.sys_time = 0.0
+        self.max_rss = 0  # in kB, for all of the command's processes together
+        self.output_tail = ''  # the last lines of the command's output
+        self.timeout_reason = ''  # set if the watchdog killed the command
+        self.cached = False  # set if the command's outputs came from the step cache
+
+    def get_cpu_time(self):
+        return self.user_time + self.sys_time
+
+    def ran_out_of_memory(self):
+        """
+        Guesses whether the command failed for lack of memory: either it was SIGKILLed (which we
+        never do ourselves except on timeout, so probably the kernel OOM killer) or its final
+        output mentions a failed allocation.
+        """
+        if self.exit_code == 0:
+            return False
+        if self.exit_code in (-signal.SIGKILL, 128 + signal.SIGKILL):
+            return True
+        return any(x in self.output_tail for x in OUT_OF_MEMORY_MESSAGES)
+
+
+class AssemblyRun(object):
+    """
+    The combined results of all commands in one assembly.
+    """
+    def __init__(self):
+        self.command_results = []
+        self.error = ''
+        self.log_filename = None
+        self.samples_filename = None
+        self.peak_rss_step = ''
+        self.oom_kills = 0
+        self.timed_out = False
+        self.abandoned = False  # set if the job gave up partway (e.g. it lost its lease)
+
+    def get_wall_time(self):
+        return sum(x.wall_time for x in self.command_results)
+
+    def get_user_time(self):
+        return sum(x.user_time for x in self.command_results)
+
+    def get_sys_time(self):
+        return sum(x.sys_time for x in self.command_results)
+
+    def get_max_rss(self):
+        return max([x.max_rss for x in self.command_results] + [0])
+
+    def get_exit_codes_str(self):
+        return ', '.join(str(x.exit_code) for x in self.command_results)
+
+    def get_parallel_efficiency(self, threads):
+        """
+        The fraction of the requested threads' time that was actually spent on the CPU.
+        """
+        try:
+            return (self.get_user_time() + self.get_sys_time()) / (self.get_wall_time() * threads)
+        except ZeroDivisionError:
+            return 0.0
+
+    def get_peak_memory_phase(self):
+        """
+        Returns the step (1-based number and program) with the highest memory usage. This comes
+        from the resource sampler if it was used (as it sums the whole process tree), otherwise
+        from each command's peak RSS.
+        """
+        if self.peak_rss_step:
+            return self.peak_rss_step
+        if not self.command_results:
+            return ''
+        peak = max(self.command_results, key=lambda x: x.max_rss)
+        return str(self.command_results.index(peak) + 1) + ': ' + get_program_name(peak.command)
+
+    def get_slowest_step(self):
+        """
+        Returns the step (1-based number and program) with the longest wall time, and its share
+        of the total.
+        """
+        if not self.command_results:
+            return ''
+        slowest = max(self.command_results, key=lambda x: x.wall_time)
+        total_time = self.get_wall_time()
+        share = 100.0 * slowest.wall_time / total_time if total_time > 0.0 else 0.0
+        return str(self.command_results.index(slowest) + 1) + ': ' + \
+            get_program_name(slowest.command) + ' (' + '%.0f' % share + '%)'
+
+    def write_steps_file(self, steps_filename):
+        """
+        Saves a table of each command's resource use.
+        """
+        with open(steps_filename, 'wt') as steps_file:
+            steps_file.write('\t'.join(['Step', 'Program', 'Wall time (s)', 'User CPU time (s)',
+                                        'System CPU time (s)', 'Peak RSS (MB)', 'Exit code',
+                                        'Timeout', 'Cached', 'Command']) + '\n')
+            for i, command_result in enumerate(self.command_results):
+                steps_file.write('\t'.join([str(i + 1), get_program_name(command_result.command),
+                                            '%.1f' % command_result.wall_time,
+                                            '%.1f' % command_result.user_time,
+                                            '%.1f' % command_result.sys_time,
+                                            '%.1f' % (command_result.max_rss / 1024),
+                                            str(command_result.exit_code),
+                                            command_result.timeout_reason,
+                                            'yes' if command_result.cached else 'no',
+                                            command_result.command]) + '\n')
+
+    def get_failure_type(self):
+        """
+        Classifies a failed assembly as 'timeout', 'oom', 'crash' (a command failed) or
+        'empty-output' (all commands succeeded but the assembly is missing or too small).
+        """
+        if self.timed_out:
+            return 'timeout'
+        if self.oom_kills or 'MemoryError' in self.error or \
+                any(x.ran_out_of_memory() for x in self.command_results):
+            return 'oom'
+        if self.error or any(x.exit_code != 0 for x in self.command_results):
+            return 'crash'
+        return 'empty-output'
+
+
+class Watchdog(object):
+    """
+    Kills a command's process group if it runs for longer than the timeout, or if it stalls:
+    no output and no CPU use by any of its processes for the stall timeout.
+    """
+    def __init__(self, pgid, timeout=None, stall_timeout=None):
+        self.pgid = pgid
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.start_time = time.time()
+        self.last_output_time = self.start_time
+        self.last_cpu_ticks = -1
+        self.last_cpu_time = self.start_time
+        self.reason = ''
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.timeout is None and self.stall_timeout is None:
+            return
+        self.thread = threading.Thread(target=self.watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def output_seen(self):
+        self.last_output_time = time.time()
+
+    def watch(self):
+        shortest_limit = min(x for x in (self.timeout, self.stall_timeout) if x is not None)
+        interval = min(max(shortest_limit / 10.0, 0.1), 10.0)
+        while not self.stop_event.wait(interval):
+            now = time.time()
+            if self.timeout is not None and now - self.start_time > self.timeout:
+                self.reason = 'timed out after ' + '%.0f' % self.timeout + ' seconds'
+            elif self.stall_timeout is not None and self.is_stalled(now):
+                self.reason = 'stalled (no output or CPU use for ' + \
+                    '%.0f' % self.stall_timeout + ' seconds)'
+            else:
+                continue
+            kill_process_group(self.pgid)
+            return
+
+    def is_stalled(self, now):
+        from unicycler_assembly_tests.resource_sampler import get_process_group_stats
+        cpu_ticks = sum(x[1][0] for x in get_process_group_stats(self.pgid))
+        if cpu_ticks != self.last_cpu_ticks:
+            self.last_cpu_ticks, self.last_cpu_time = cpu_ticks, now
+        return now - max(self.last_output_time, self.last_cpu_time) > self.stall_timeout
+
+
+def run_command(command, cwd, sampler=None, step=0, memory_limit=None, log_file=None,
+                tee=False, timeout=None, stall_timeout=None):
+    """
+    Runs one shell command to completion and returns a CommandResult. The command gets its own
+    process group, which lets the sampler (if given) find all of its processes and lets the
+    whole command be killed if it exceeds the timeout or stalls (both in seconds). If a
+    MemoryLimit is given, the command runs under it.
+
+    The command's output is written to log_file (a binary file object) as it is produced and,
+    if tee is True, to the console as well.
+    """
+    result = CommandResult(command)
+    if memory_limit is not None:
+        command = memory_limit.wrap_command(command)
+    tail = collections.deque(maxlen=TAIL_LINE_COUNT)
+    start_time = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               shell=True, cwd=cwd, start_new_session=True)
+    with running_process_groups_lock:
+        running_process_groups.add(process.pid)
+    if sampler is not None:
+        sampler.set_command(step, command, process.pid)
+        tree_monitor = None
+    else:
+        from unicycler_assembly_tests.resource_sampler import ProcessTreeMonitor
+        tree_monitor = ProcessTreeMonitor(process.pid)
+        tree_monitor.start()
+    watchdog = Watchdog(process.pid, timeout, stall_timeout)
+    watchdog.start()
+    try:
+        for line in process.stdout:
+            watchdog.output_seen()
+            if log_file is not None:
+                log_file.write(line)
+            if tee:
+                sys.stdout.buffer.write(line)
+                sys.stdout.flush()
+            tail.append(line[:TAIL_LINE_LENGTH])
+    except BaseException:
+        # Don't leave the command running if we are interrupted.
+        kill_process_group(process.pid)
+        raise
+    finally:
+        process.stdout.close()
+        watchdog.stop()
+        result.timeout_reason = watchdog.reason
+        if watchdog.reason:  # make sure nothing in the group outlives the command
+            kill_process_group(process.pid)
+        _, status, rusage = os.wait4(process.pid, 0)
+        if tree_monitor is not None:
+            tree_peak_rss = tree_monitor.stop()
+        else:
+            tree_peak_rss = sampler.step_peak_rss.get(step, 0)
+        with running_process_groups_lock:
+            running_process_groups.discard(process.pid)
+        result.wall_time = time.time() - start_time
+        result.exit_code = get_exit_code(status)
+        process.returncode = result.exit_code  # stop Popen from trying to reap it again
+        result.user_time = rusage.ru_utime
+        result.sys_time = rusage.ru_stime
+        result.max_rss = max(rusage.ru_maxrss, tree_peak_rss)
+    result.output_tail = b''.join(tail).decode(errors='replace')
+    return result
+
+
+def get_program_name(command):
+    """
+    Returns the name of the program a shell command runs (skipping any leading environment
+    variable settings), e.g. 'bwa' for '/opt/bin/bwa mem ref.fasta reads.fastq'.
+    """
+    for part in command.split():
+        if '=' not in part:
+            return os.path.basename(part)
+    return ''
+
+
+def kill_process_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:  # already gone
+        pass
+
+
+def kill_running_commands():
+    with running_process_groups_lock:
+        process_groups = list(running_process_groups)
+    for pgid in process_groups:
+        kill_process_group(pgid)
+
+
+def install_signal_handlers():
+    """
+    Makes SIGINT, SIGTERM and SIGHUP kill all running commands' process groups before this
+    process exits, so no assembler is left running without its parent. Must be called from the
+    main thread.
+    """
+    for signal_number in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signal_number, handle_termination_signal)
+
+
+def handle_termination_signal(signal_number, _):
+    kill_running_commands()
+    if signal_number == signal.SIGINT:
+        raise KeyboardInterrupt
+    sys.exit(128 + signal_number)
+
+
+def get_exit_code(status):
+    """
+    Converts a wait status to an exit code, using the subprocess convention of -N for a process
+    killed by signal N.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
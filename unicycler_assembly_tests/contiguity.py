@@ -0,0 +1,105 @@
+"""
+Computes QUAST's contiguity metrics (contig counts and total lengths at various thresholds, N50,
+NG50, L50, etc. and GC) in one streaming pass over an assembly FASTA, without running QUAST.
+
+The values follow QUAST's conventions: the thresholded counts/lengths use all contigs, while
+'# contigs', 'Total length', 'Largest contig', GC and the N/L metrics only use contigs of at
+least 500 bp (QUAST's default --min-contig). Metrics which can't be reached (e.g. NG50 for an
+assembly shorter than half the reference) are '-', as in QUAST's report.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import gzip
+from unicycler_assembly_tests.misc import get_compression_type
+
+
+THRESHOLDS = [0, 1000, 5000, 10000, 25000, 50000]
+MIN_CONTIG = 500
+
+
+def get_contig_stats(fasta):
+    """
+    Returns a list of (length, GC count, ACGT count) tuples, one per contig.
+    """
+    if get_compression_type(fasta) == 'gz':
+        open_func = gzip.open
+    else:  # plain text
+        open_func = open
+
+    contig_stats = []
+    length, gc_count, acgt_count = 0, 0, 0
+    in_contig = False
+    with open_func(fasta, 'rt') as fasta_file:
+        for line in fasta_file:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '>':
+                if in_contig:
+                    contig_stats.append((length, gc_count, acgt_count))
+                length, gc_count, acgt_count = 0, 0, 0
+                in_contig = True
+            else:
+                line = line.upper()
+                length += len(line)
+                gc = line.count('G') + line.count('C')
+                gc_count += gc
+                acgt_count += gc + line.count('A') + line.count('T')
+    if in_contig:
+        contig_stats.append((length, gc_count, acgt_count))
+    return contig_stats
+
+
+def get_fasta_length(fasta):
+    return sum(x[0] for x in get_contig_stats(fasta))
+
+
+def get_contiguity_metrics(fasta, reference_length=0):
+    """
+    Returns a dictionary of QUAST report names to values for the assembly. The NG/LG metrics are
+    only included if a reference length is given.
+    """
+    contig_stats = get_contig_stats(fasta)
+    all_lengths = [x[0] for x in contig_stats]
+    metrics = {}
+    for threshold in THRESHOLDS:
+        lengths = [x for x in all_lengths if x >= threshold]
+        metrics['# contigs (>= ' + str(threshold) + ' bp)'] = str(len(lengths))
+        metrics['Total length (>= ' + str(threshold) + ' bp)'] = str(sum(lengths))
+
+    contig_stats = [x for x in contig_stats if x[0] >= MIN_CONTIG]
+    lengths = sorted((x[0] for x in contig_stats), reverse=True)
+    total_length = sum(lengths)
+    metrics['# contigs'] = str(len(lengths))
+    metrics['Largest contig'] = str(lengths[0]) if lengths else '0'
+    metrics['Total length'] = str(total_length)
+    acgt_count = sum(x[2] for x in contig_stats)
+    if acgt_count:
+        metrics['GC (%)'] = '%.2f' % (100.0 * sum(x[1] for x in contig_stats) / acgt_count)
+    else:
+        metrics['GC (%)'] = '-'
+
+    for percent in (50, 75):
+        n, l = get_nx_and_lx(lengths, total_length, percent)
+        metrics['N' + str(percent)] = n
+        metrics['L' + str(percent)] = l
+        if reference_length:
+            ng, lg = get_nx_and_lx(lengths, reference_length, percent)
+            metrics['NG' + str(percent)] = ng
+            metrics['LG' + str(percent)] = lg
+    return metrics
+
+
+def get_nx_and_lx(sorted_lengths, total_length, percent):
+    """
+    Returns Nx and Lx (as strings) for contig lengths sorted from largest to smallest.
+    """
+    target = total_length * percent / 100.0
+    cumulative_length = 0
+    for i, length in enumerate(sorted_lengths):
+        cumulative_length += length
+        if cumulative_length >= target:
+            return str(length), str(i + 1)
+    return '-', '-'
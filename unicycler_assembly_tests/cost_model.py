@@ -0,0 +1,150 @@
+"""
+A simple model of how long assemblies take and how much memory they need, fitted from the rows
+of past results tables.
+
+Time and peak memory are assumed to scale with the reference length, so the model stores them
+per Mbp of reference. A job is predicted from the median of the most similar past assemblies:
+the same assembler, setting, version, read set type, read qualities and thread count if there
+are any, then falling back to less specific groups (down to just the same assembler).
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import statistics
+
+
+DEFAULT_REFERENCE_LENGTH = 5000000  # used when there is no reference, like GENOME_SIZE
+
+FEATURE_LEVELS = [('assembler', 'setting', 'version', 'set_type', 'illumina_quality',
+                   'long_quality', 'threads'),
+                  ('assembler', 'setting', 'set_type', 'illumina_quality', 'long_quality',
+                   'threads'),
+                  ('assembler', 'setting', 'set_type', 'threads'),
+                  ('assembler', 'setting', 'set_type'),
+                  ('assembler', 'set_type'),
+                  ('assembler',)]
+
+
+class JobFeatures(object):
+    def __init__(self, assembler, setting, version, set_type, illumina_quality, long_quality,
+                 threads, reference_length):
+        self.assembler = assembler
+        self.setting = setting
+        self.version = version
+        self.set_type = set_type
+        self.illumina_quality = illumina_quality
+        self.long_quality = long_quality
+        self.threads = threads
+        self.reference_length = reference_length if reference_length else \
+            DEFAULT_REFERENCE_LENGTH
+
+    def get_key(self, level):
+        return tuple(getattr(self, x) for x in FEATURE_LEVELS[level])
+
+
+class Prediction(object):
+    def __init__(self, time, mem, sample_count, level):
+        self.time = time  # seconds
+        self.mem = mem  # GB, or None if the past results didn't record memory
+        self.sample_count = sample_count
+        self.level = level  # 0 is the most specific match
+
+
+class CostModel(object):
+    def __init__(self):
+        self.times = [{} for _ in FEATURE_LEVELS]  # key -> list of seconds per Mbp
+        self.mems = [{} for _ in FEATURE_LEVELS]  # key -> list of GB per Mbp
+        self.row_count = 0
+
+    def add(self, features, time, mem=None):
+        reference_mbp = features.reference_length / 1000000.0
+        for level in range(len(FEATURE_LEVELS)):
+            key = features.get_key(level)
+            self.times[level].setdefault(key, []).append(time / reference_mbp)
+            if mem is not None:
+                self.mems[level].setdefault(key, []).append(mem / reference_mbp)
+        self.row_count += 1
+
+    def add_results_table(self, results_filename):
+        """
+        Adds the successful assemblies in a results table (results.tsv).
+        """
+        with open(results_filename, 'rt') as results_table:
+            headers = results_table.readline().rstrip('\n').split('\t')
+            for line in results_table:
+                row = dict(zip(headers, line.rstrip('\n').split('\t')))
+                if row.get('Assembly result') != 'success':
+                    continue
+                try:
+                    time = float(row['Assembly time (seconds)'])
+                    reference_length = int(row.get('Reference total length') or 0)
+                except (KeyError, ValueError):
+                    continue
+                try:
+                    mem = float(row['Assembly peak RSS (MB)']) / 1024.0
+                except (KeyError, ValueError):
+                    mem = None
+                features = JobFeatures(row.get('Assembler', ''),
+                                       row.get('Assembler setting/output', ''),
+                                       row.get('Assembler version', ''),
+                                       row.get('Read set type', ''),
+                                       row.get('Fake Illumina read quality', ''),
+                                       row.get('Fake long read quality', ''),
+                                       row.get('Threads', ''), reference_length)
+                self.add(features, time, mem)
+
+    def predict(self, features):
+        """
+        Returns a Prediction for the job, or None if there are no past results for its assembler.
+        """
+        reference_mbp = features.reference_length / 1000000.0
+        for level in range(len(FEATURE_LEVELS)):
+            key = features.get_key(level)
+            times = self.times[level].get(key)
+            if not times:
+                continue
+            mems = self.mems[level].get(key)
+            mem = statistics.median(mems) * reference_mbp if mems else None
+            return Prediction(statistics.median(times) * reference_mbp, mem, len(times), level)
+        return None
+
+
+def load_cost_model(results_filenames):
+    cost_model = CostModel()
+    for results_filename in results_filenames:
+        try:
+            cost_model.add_results_table(results_filename)
+        except OSError:
+            pass
+    return cost_model
+
+
+def predict_makespan(jobs, max_jobs, max_cores, max_mem):
+    """
+    Simulates the ResourceScheduler (jobs start in order, but a later job can start first if an
+    earlier one doesn't fit) on jobs given as (time, cores, mem) tuples, and returns the total
+    time.
+    """
+    pending = list(jobs)
+    running = []  # (end time, cores, mem)
+    now = 0.0
+    while pending or running:
+        started = True
+        while started:
+            started = False
+            if len(running) >= max_jobs:
+                break
+            free_cores = max_cores - sum(x[1] for x in running)
+            free_mem = max_mem - sum(x[2] for x in running)
+            for job in pending:
+                time, cores, mem = job[0], min(job[1], max_cores), min(job[2], max_mem)
+                if cores <= free_cores and mem <= free_mem:
+                    pending.remove(job)
+                    running.append((now + time, cores, mem))
+                    started = True
+                    break
+        if running:
+            running.sort()
+            now = running.pop(0)[0]
+    return now
@@ -0,0 +1,133 @@
+"""
+A report of how assemblies scale with read depth, made from the results of a depth sweep (read
+sets subsampled to several depths and assembled alongside the full read sets).
+
+For each assembler (and setting, version and thread count) and each depth, the report gives
+the median actual read depth, wall time, CPU time and peak memory. It also gives the scaling
+exponents of time and memory: the slope of log(time) or log(memory) against log(depth), fitted
+separately for each read set and its subsets, then the median taken. An exponent of 1 means
+linear scaling, 2 quadratic, and near 0 means depth makes little difference.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import math
+import statistics
+from collections import OrderedDict
+
+
+REPORT_COLUMNS = ['Assembler', 'Assembler version', 'Assembler setting/output', 'Threads',
+                  'Depth', 'Read sets', 'Median read depth', 'Median wall time (s)',
+                  'Median CPU time (s)', 'Median peak RSS (MB)', 'Time exponent',
+                  'Memory exponent']
+
+
+def write_depth_report(results_filename, report_filename, depth_labels):
+    """
+    Writes the report for the read sets which were subsampled (those with a depth label at the
+    end of their name, e.g. '__20x') and their full read sets, and prints a summary.
+    """
+    groups = load_depth_results(results_filename, depth_labels)
+    report_rows, exponent_summaries = [], []
+    for group, read_set_levels in groups.items():
+        time_exponent = get_median_exponent(read_set_levels, 1)
+        memory_exponent = get_median_exponent(read_set_levels, 3)
+        exponent_summaries.append(' '.join(group[:3]) + ': time ~ depth^' +
+                                  (time_exponent or '?') + ', memory ~ depth^' +
+                                  (memory_exponent or '?'))
+        labels = set(x for levels in read_set_levels.values() for x in levels)
+        labels = [x for x in depth_labels if x in labels] + (['full'] if 'full' in labels else [])
+        for label in labels:
+            values = [x[label] for x in read_set_levels.values() if label in x]
+            report_rows.append(list(group) + [label, str(len(values))] +
+                               ['%.1f' % statistics.median(x[i] for x in values)
+                                for i in range(4)] +
+                               [time_exponent, memory_exponent])
+
+    with open(report_filename, 'wt') as report:
+        report.write('\t'.join(REPORT_COLUMNS) + '\n')
+        for row in report_rows:
+            report.write('\t'.join(row) + '\n')
+
+    print()
+    print('Depth scaling (medians over read sets):')
+    for row in report_rows:
+        print('  ' + ' '.join(row[:3]) + ', ' + row[4] + ' (' + row[6] + 'x): ' + row[7] +
+              ' s, ' + row[9] + ' MB')
+    for exponent_summary in exponent_summaries:
+        print('  ' + exponent_summary)
+    print('Full report: ' + report_filename, flush=True)
+
+
+def load_depth_results(results_filename, depth_labels):
+    """
+    Returns an OrderedDict of (assembler, version, setting, threads) to a dictionary of full read
+    set name to a dictionary of depth label ('full' for the full read set) to (read depth, wall
+    time, CPU time, peak RSS). Only read sets with at least one subset are included.
+    """
+    groups = OrderedDict()
+    with open(results_filename, 'rt') as results_table:
+        headers = results_table.readline().rstrip('\n').split('\t')
+        for line in results_table:
+            row = dict(zip(headers, line.rstrip('\n').split('\t')))
+            if row.get('Assembly result') != 'success':
+                continue
+            try:
+                values = (float(row['Read depth']), float(row['Assembly time (seconds)']),
+                          float(row['Assembly user CPU time (seconds)']) +
+                          float(row['Assembly system CPU time (seconds)']),
+                          float(row['Assembly peak RSS (MB)']))
+            except (KeyError, ValueError):
+                continue
+            set_name, label = split_depth_label(row['Read set name'], depth_labels)
+            group = (row['Assembler'], row['Assembler version'],
+                     row['Assembler setting/output'], row.get('Threads', ''))
+            groups.setdefault(group, OrderedDict()).setdefault(set_name, {})[label] = values
+    for group in list(groups):
+        groups[group] = OrderedDict((x, y) for x, y in groups[group].items()
+                                    if any(z != 'full' for z in y))
+        if not groups[group]:
+            del groups[group]
+    return groups
+
+
+def split_depth_label(read_set_name, depth_labels):
+    """
+    Returns the full read set's name and the depth label, e.g. ('Ecoli__good_short', '20x').
+    """
+    for label in depth_labels:
+        if read_set_name.endswith('__' + label):
+            return read_set_name[:-len(label) - 2], label
+    return read_set_name, 'full'
+
+
+def get_median_exponent(read_set_levels, value_index):
+    """
+    Fits the log-log slope of a value (by its index in the level tuples) against read depth for
+    each read set and returns the median as a string ('' if no read set has enough points).
+    """
+    exponents = []
+    for levels in read_set_levels.values():
+        points = [(math.log(x[0]), math.log(x[value_index])) for x in levels.values()
+                  if x[0] > 0.0 and x[value_index] > 0.0]
+        exponent = get_slope(points)
+        if exponent is not None:
+            exponents.append(exponent)
+    if not exponents:
+        return ''
+    return '%.2f' % statistics.median(exponents)
+
+
+def get_slope(points):
+    """
+    The least-squares slope of (x, y) points, or None if the x values don't vary.
+    """
+    if len(points) < 2:
+        return None
+    mean_x = sum(x[0] for x in points) / len(points)
+    mean_y = sum(x[1] for x in points) / len(points)
+    x_variance = sum((x[0] - mean_x) ** 2 for x in points)
+    if x_variance == 0.0:
+        return None
+    return sum((x[0] - mean_x) * (x[1] - mean_y) for x in points) / x_variance
@@ -0,0 +1,192 @@
+"""
+Computes summary statistics of an assembly graph (GFA or SPAdes-style FASTG) in one streaming
+pass. Only segment lengths and links are kept, in compact integer arrays, so this uses far less
+memory than loading the graph with Unicycler's AssemblyGraph (and doesn't need Unicycler).
+
+Oriented segments are stored as integers: 2 * i for the forward strand of segment i and
+2 * i + 1 for its reverse complement. Each link implies its reverse complement link, as in
+Unicycler. Links are deduplicated within integer arrays grouped by their start, not in a set of
+all links.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import gzip
+from array import array
+from unicycler_assembly_tests.misc import get_compression_type
+
+
+class GraphStats(object):
+    def __init__(self):
+        self.segment_count = 0
+        self.total_length = 0
+        self.dead_ends = 0
+        self.connected_components = 0
+        self.circular_components = 0
+
+    def get_percent_dead_ends(self):
+        if self.segment_count == 0:
+            return 0.0
+        return 100.0 * self.dead_ends / self.segment_count
+
+
+class GraphReader(object):
+    def __init__(self):
+        self.segment_ids = {}
+        self.lengths = array('q')
+        self.link_starts = array('q')
+        self.link_ends = array('q')
+
+    def get_segment_index(self, name):
+        try:
+            return self.segment_ids[name]
+        except KeyError:
+            index = len(self.lengths)
+            self.segment_ids[name] = index
+            self.lengths.append(0)
+            return index
+
+    def add_link(self, start_name, start_strand, end_name, end_strand):
+        start = 2 * self.get_segment_index(start_name) + (0 if start_strand == '+' else 1)
+        end = 2 * self.get_segment_index(end_name) + (0 if end_strand == '+' else 1)
+        self.link_starts.append(start)
+        self.link_ends.append(end)
+
+    def read_gfa(self, graph_file):
+        for line in graph_file:
+            if line.startswith('S\t'):
+                parts = line.rstrip('\n').split('\t')
+                index = self.get_segment_index(parts[1])
+                if parts[2] != '*':
+                    self.lengths[index] = len(parts[2])
+                else:  # sequence not included, so look for a length tag
+                    for tag in parts[3:]:
+                        if tag.startswith('LN:i:'):
+                            self.lengths[index] = int(tag[5:])
+            elif line.startswith('L\t'):
+                parts = line.split('\t')
+                self.add_link(parts[1], parts[2], parts[3], parts[4])
+
+    def read_fastg(self, graph_file):
+        """
+        FASTG headers look like this (a ' marks the reverse complement):
+        >EDGE_1_length_5000_cov_10.0:EDGE_2_length_300_cov_12.0',EDGE_3_length_800_cov_9.0;
+        """
+        index, strand = None, '+'
+        for line in graph_file:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '>':
+                index = None
+                parts = line[1:].rstrip(';').split(':')
+                name, strand = get_fastg_name_and_strand(parts[0])
+                if strand == '+':
+                    index = self.get_segment_index(name)
+                    try:
+                        self.lengths[index] = int(parts[0].split('_length_')[1].split('_')[0])
+                        index = None  # length is known, so no need to count the sequence
+                    except (IndexError, ValueError):
+                        pass
+                if len(parts) > 1:
+                    for end in parts[1].split(','):
+                        end_name, end_strand = get_fastg_name_and_strand(end)
+                        self.add_link(name, strand, end_name, end_strand)
+            elif index is not None:
+                self.lengths[index] += len(line)
+
+    def get_stats(self):
+        segment_count = len(self.lengths)
+        stats = GraphStats()
+        stats.segment_count = segment_count
+        stats.total_length = sum(self.lengths)
+
+        # Unique links, including the reverse complement of each. The links' ends are grouped by
+        # their start (a counting sort into one array), so duplicates only need to be found
+        # among the few links sharing a start.
+        oriented_count = 2 * segment_count
+        offsets = array('q', [0]) * (oriented_count + 1)
+        for start, end in zip(self.link_starts, self.link_ends):
+            offsets[start + 1] += 1
+            offsets[(end ^ 1) + 1] += 1
+        for i in range(oriented_count):
+            offsets[i + 1] += offsets[i]
+        grouped_ends = array('q', [0]) * offsets[oriented_count]
+        next_slots = array('q', offsets)
+        for start, end in zip(self.link_starts, self.link_ends):
+            grouped_ends[next_slots[start]] = end
+            next_slots[start] += 1
+            grouped_ends[next_slots[end ^ 1]] = start ^ 1
+            next_slots[end ^ 1] += 1
+        del next_slots
+
+        out_degrees = array('q', [0]) * oriented_count
+        in_degrees = array('q', [0]) * oriented_count
+        parents = array('q', range(segment_count))
+        for start in range(oriented_count):
+            for end in set(grouped_ends[offsets[start]:offsets[start + 1]]):
+                out_degrees[start] += 1
+                in_degrees[end] += 1
+                union(parents, start // 2, end // 2)
+
+        # Like Unicycler, each segment can have a dead end at its start and at its end.
+        for i in range(segment_count):
+            if in_degrees[2 * i] == 0:
+                stats.dead_ends += 1
+            if out_degrees[2 * i] == 0:
+                stats.dead_ends += 1
+
+        # A component is circular if it is a simple loop: every segment has exactly one link in
+        # and one link out.
+        simple_loop = {}
+        for i in range(segment_count):
+            root = find(parents, i)
+            is_simple = in_degrees[2 * i] == 1 and out_degrees[2 * i] == 1
+            simple_loop[root] = simple_loop.get(root, True) and is_simple
+        stats.connected_components = len(simple_loop)
+        stats.circular_components = sum(1 for x in simple_loop.values() if x)
+        return stats
+
+
+def get_fastg_name_and_strand(fastg_name):
+    if fastg_name.endswith("'"):
+        return get_fastg_segment_name(fastg_name[:-1]), '-'
+    return get_fastg_segment_name(fastg_name), '+'
+
+
+def get_fastg_segment_name(fastg_name):
+    """
+    Reduces a SPAdes edge name (e.g. EDGE_1_length_5000_cov_10.0) to its number.
+    """
+    parts = fastg_name.split('_')
+    if len(parts) > 1 and parts[0] == 'EDGE':
+        return parts[1]
+    return fastg_name
+
+
+def find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def union(parents, i, j):
+    root_i, root_j = find(parents, i), find(parents, j)
+    if root_i != root_j:
+        parents[root_j] = root_i
+
+
+def get_graph_stats(graph_filename):
+    if get_compression_type(graph_filename) == 'gz':
+        open_func = gzip.open
+    else:  # plain text
+        open_func = open
+    reader = GraphReader()
+    with open_func(graph_filename, 'rt') as graph_file:
+        if '.fastg' in graph_filename:
+            reader.read_fastg(graph_file)
+        else:
+            reader.read_gfa(graph_file)
+    return reader.get_stats()
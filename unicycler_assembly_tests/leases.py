@@ -0,0 +1,176 @@
+"""
+Lease files which let several assembler_comparison processes (possibly on different hosts)
+share one output directory without assembling the same read set twice.
+
+A lease is claimed by hard-linking a uniquely named file to the lease's name, which is atomic
+even on NFS (where a link's success is judged by the unique file's link count, as the reply to
+the link call can be lost). While a lease is held, a heartbeat thread keeps updating its
+modification time. A lease which hasn't been updated for the timeout (e.g. its process crashed
+or its host went down) has expired and can be reclaimed. Ages are judged against the
+modification time of a freshly written file in the same directory, so only the file server's
+clock matters. A worker which finds its lease taken over (e.g. after a long NFS stall) gives up
+its assembly.
+
+When an assembly fails, its worker leaves a failure marker next to the lease, so other workers
+don't run the same failing assembly again. Delete the marker to retry it.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import os
+import socket
+import threading
+import uuid
+
+
+LEASE_DIR_NAME = 'LEASES'
+
+
+class Lease(object):
+    def __init__(self, lease_dir, name, timeout):
+        self.lease_dir = lease_dir
+        self.name = name
+        self.filename = get_lease_filename(lease_dir, name)
+        self.timeout = timeout
+        self.owner = socket.gethostname() + ' ' + str(os.getpid()) + ' ' + uuid.uuid4().hex
+        self.heartbeat_thread = None
+        self.stop_event = threading.Event()
+        self.lost = False
+        self.release_count = 1
+        self.release_lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Tries to claim the lease, breaking it first if it has expired. Returns whether it was
+        claimed.
+        """
+        os.makedirs(self.lease_dir, exist_ok=True)
+        unique_filename = self.filename + '.' + self.owner.split()[-1]
+        with open(unique_filename, 'wt') as unique_file:
+            unique_file.write(self.owner + '\n')
+        try:
+            for attempt in range(2):
+                try:
+                    os.link(unique_filename, self.filename)
+                except OSError:
+                    pass
+                if os.stat(unique_filename).st_nlink == 2:
+                    self.start_heartbeat()
+                    return True
+                if attempt > 0 or not self.break_if_expired(unique_filename):
+                    return False
+            return False
+        finally:
+            os.remove(unique_filename)
+
+    def break_if_expired(self, fresh_filename):
+        """
+        Removes the lease if it has expired, returning whether it is now free to claim. The lease
+        is renamed before being removed, so only one process can break it.
+        """
+        try:
+            age = os.stat(fresh_filename).st_mtime - os.stat(self.filename).st_mtime
+        except FileNotFoundError:
+            return True
+        if age < self.timeout:
+            return False
+        stale_filename = self.filename + '.stale.' + self.owner.split()[-1]
+        try:
+            os.rename(self.filename, stale_filename)
+        except FileNotFoundError:  # another process broke it first
+            return True
+        os.remove(stale_filename)
+        print('Reclaimed expired lease: ' + os.path.basename(self.filename), flush=True)
+        return True
+
+    def start_heartbeat(self):
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat)
+        self.heartbeat_thread.daemon = True
+        self.heartbeat_thread.start()
+
+    def heartbeat(self):
+        while not self.stop_event.wait(self.timeout / 4.0):
+            if not self.is_owned():
+                self.lost = True
+                print('Lost lease: ' + os.path.basename(self.filename), flush=True)
+                return
+            try:
+                os.utime(self.filename)
+            except OSError:
+                pass
+
+    def is_owned(self):
+        try:
+            with open(self.filename, 'rt') as lease_file:
+                return lease_file.read().strip() == self.owner
+        except OSError:
+            return False
+
+    def share(self, count):
+        """
+        Makes the lease only be released once release has been called this many times (e.g. once
+        for each of an assembly's outputs).
+        """
+        with self.release_lock:
+            self.release_count = count
+
+    def release(self):
+        with self.release_lock:
+            self.release_count -= 1
+            if self.release_count > 0:
+                return
+        self.stop_event.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+        if self.is_owned():
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+    def mark_failed(self):
+        """
+        Records that this lease's assembly failed, so other workers skip it.
+        """
+        try:
+            with open(get_failure_filename(self.lease_dir, self.name), 'wt') as failure_file:
+                failure_file.write(self.owner + '\n')
+        except OSError:
+            pass
+
+    def get_holder(self):
+        """
+        Returns the host and PID of the lease's current holder (or '' if it is free).
+        """
+        try:
+            with open(self.filename, 'rt') as lease_file:
+                return ' '.join(lease_file.read().split()[:2])
+        except OSError:
+            return ''
+
+
+def get_lease_filename(lease_dir, name):
+    return os.path.join(lease_dir, name + '.lease')
+
+
+def get_failure_filename(lease_dir, name):
+    return os.path.join(lease_dir, name + '.failed')
+
+
+def get_failed_holder(lease_dir, name):
+    """
+    Returns the host and PID of the worker whose assembly failed (or '' if it hasn't failed).
+    """
+    try:
+        with open(get_failure_filename(lease_dir, name), 'rt') as failure_file:
+            return ' '.join(failure_file.read().split()[:2]) or 'unknown worker'
+    except OSError:
+        return ''
+
+
+def is_leased(lease_dir, name):
+    """
+    Whether the lease exists (held by a live worker, or expired and waiting to be reclaimed).
+    """
+    return os.path.exists(get_lease_filename(lease_dir, name))
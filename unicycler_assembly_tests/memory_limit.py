@@ -0,0 +1,151 @@
+"""
+Enforces a hard memory ceiling on an assembly job.
+
+Where possible, the job's commands are put in a child cgroup (cgroup v2) with memory.max set, so
+the limit applies to the whole process tree and the kernel's OOM kills are counted. This needs
+a cgroup we can write to (e.g. a delegated cgroup from systemd or Slurm). Since cgroup v2 only
+lets a cgroup without processes of its own enable controllers for its children, this process
+first moves itself into a leaf child cgroup, then enables the memory controller and makes the
+jobs' cgroups alongside it.
+
+Otherwise each process gets a data segment rlimit, which makes allocations beyond the limit
+fail instead. That limit is per process, not for the whole job, so a job of several processes
+can use more than the limit in total.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import os
+import threading
+
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# The leaf cgroup this process moves itself into, so its original cgroup can have job children.
+RUNNER_CGROUP_NAME = 'assembler_comparison'
+
+# The cgroup which job cgroups are made in (once set up), or None if cgroups can't be used.
+job_cgroup_parent = None
+job_cgroup_parent_ready = False
+job_cgroup_parent_lock = threading.Lock()
+
+
+class MemoryLimit(object):
+    def __init__(self, limit_gb, name):
+        self.limit_bytes = int(limit_gb * 1073741824)
+        self.cgroup_dir = create_cgroup(name, self.limit_bytes)
+
+    def get_method(self):
+        return 'cgroup' if self.cgroup_dir else 'rlimit'
+
+    def wrap_command(self, command):
+        """
+        Returns the shell command with a prefix that applies the limit. The shell runs the prefix
+        before starting anything, so every process in the command inherits the limit.
+        """
+        if self.cgroup_dir:
+            procs = os.path.join(self.cgroup_dir, 'cgroup.procs')
+            return 'echo $$ > ' + procs + ' && ' + command
+        else:
+            return 'ulimit -d ' + str(self.limit_bytes // 1024) + ' && ' + command
+
+    def get_oom_kill_count(self):
+        if not self.cgroup_dir:
+            return 0
+        try:
+            with open(os.path.join(self.cgroup_dir, 'memory.events'), 'rt') as events:
+                for line in events:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[0] == 'oom_kill':
+                        return int(parts[1])
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    def remove(self):
+        if self.cgroup_dir:
+            try:
+                os.rmdir(self.cgroup_dir)
+            except OSError:  # processes are still in it
+                pass
+
+
+def get_own_cgroup_dir():
+    """
+    Returns the cgroup v2 directory this process is in, or None if cgroup v2 isn't in use.
+    """
+    if not os.path.isfile(os.path.join(CGROUP_ROOT, 'cgroup.controllers')):
+        return None
+    try:
+        with open('/proc/self/cgroup', 'rt') as cgroup_file:
+            for line in cgroup_file:
+                if line.startswith('0::'):
+                    return os.path.join(CGROUP_ROOT, line.strip()[3:].lstrip('/'))
+    except OSError:
+        pass
+    return None
+
+
+def get_job_cgroup_parent():
+    """
+    Returns the cgroup to make job cgroups in, setting it up the first time: this process moves
+    into a leaf child of its cgroup (if it isn't already there) and the memory controller is
+    enabled for the children. Returns None if that isn't possible.
+    """
+    global job_cgroup_parent, job_cgroup_parent_ready
+    with job_cgroup_parent_lock:
+        if not job_cgroup_parent_ready:
+            job_cgroup_parent = set_up_job_cgroup_parent()
+            job_cgroup_parent_ready = True
+        return job_cgroup_parent
+
+
+def set_up_job_cgroup_parent():
+    own_dir = get_own_cgroup_dir()
+    if own_dir is None:
+        return None
+    if os.path.basename(own_dir) == RUNNER_CGROUP_NAME:  # e.g. started by a process which moved
+        parent_dir = os.path.dirname(own_dir)
+    else:
+        parent_dir = own_dir
+    subtree_control = os.path.join(parent_dir, 'cgroup.subtree_control')
+    try:
+        with open(subtree_control, 'rt') as subtree_file:
+            controllers = subtree_file.read().split()
+        if 'memory' not in controllers:
+            if parent_dir == own_dir:
+                runner_dir = os.path.join(parent_dir, RUNNER_CGROUP_NAME)
+                os.makedirs(runner_dir, exist_ok=True)
+                with open(os.path.join(runner_dir, 'cgroup.procs'), 'wt') as procs:
+                    procs.write(str(os.getpid()))
+            with open(subtree_control, 'wt') as subtree_file:
+                subtree_file.write('+memory')
+    except OSError:
+        return None
+    return parent_dir
+
+
+def create_cgroup(name, limit_bytes):
+    """
+    Tries to make a child cgroup with the memory limit, returning its path (or None on failure).
+    """
+    parent_dir = get_job_cgroup_parent()
+    if parent_dir is None:
+        return None
+    cgroup_dir = os.path.join(parent_dir, name)
+    try:
+        os.mkdir(cgroup_dir)
+    except OSError:
+        return None
+    try:
+        with open(os.path.join(cgroup_dir, 'memory.max'), 'wt') as memory_max:
+            memory_max.write(str(limit_bytes))
+        swap_max = os.path.join(cgroup_dir, 'memory.swap.max')
+        if os.path.isfile(swap_max):
+            with open(swap_max, 'wt') as swap_max_file:
+                swap_max_file.write('0')
+    except OSError:
+        os.rmdir(cgroup_dir)
+        return None
+    return cgroup_dir
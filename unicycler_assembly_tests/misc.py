@@ -86,6 +86,34 @@ def get_compression_type(filename):
     return compression_type
 
 
+def parse_duration(duration_str):
+    """
+    Converts a duration like '90', '90s', '30m' or '2h' to seconds. Raises ValueError if it can't.
+    """
+    duration_str = duration_str.strip()
+    multipliers = {'s': 1, 'm': 60, 'h': 3600}
+    multiplier = 1
+    if duration_str and duration_str[-1] in multipliers:
+        multiplier = multipliers[duration_str[-1]]
+        duration_str = duration_str[:-1]
+    seconds = float(duration_str) * multiplier
+    if seconds <= 0.0:
+        raise ValueError('duration must be positive')
+    return seconds
+
+
+def format_duration(seconds):
+    """
+    Converts seconds to a short human-readable duration, like '45s', '12m 30s' or '3h 05m'.
+    """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return str(seconds) + 's'
+    if seconds < 3600:
+        return str(seconds // 60) + 'm ' + '%02d' % (seconds % 60) + 's'
+    return str(seconds // 3600) + 'h ' + '%02d' % ((seconds % 3600) // 60) + 'm'
+
+
 def get_relative_depths(reference):
     references = load_fasta(reference)
     longest_len = 0
@@ -0,0 +1,194 @@
+"""
+Functions for running QUAST on assemblies, either one at a time or in batches.
+
+A batch is a group of assemblies which share a reference. QUAST is run once for the whole batch,
+so the reference is only indexed once, and its combined report.tsv (one column per assembly) is
+split back into each assembly's results. Batches are filled from a queue in the output directory,
+so they can gather assemblies from several runs or workers.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict
+
+
+# Assemblies waiting for batched QUAST runs, in the output directory.
+QUAST_QUEUE_DIR_NAME = 'quast_queue'
+
+
+def run_quast(fasta, read_set, out_dir, result, threads=None):
+    quast_dir = tempfile.mkdtemp(prefix='QUAST_TEMP_' + str(os.getpid()) + '_', dir=out_dir)
+
+    quast_command = ['quast.py', fasta]
+
+    if read_set.reference:
+        quast_command += ['-R', read_set.reference]
+
+    quast_command += ['-o', quast_dir,
+                      '-l', '"' + read_set.set_name.replace(',', '') + '"',
+                      '--no-plots', '--strict-NA']
+    if threads is not None:
+        quast_command += ['--threads', str(threads)]
+    print()
+    print(' '.join(quast_command))
+    process = subprocess.Popen(quast_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, _ = process.communicate()
+
+    load_quast_report(os.path.join(quast_dir, 'report.tsv'), [result])
+    shutil.rmtree(quast_dir)
+
+
+def run_batched_quast(fastas, reference, out_dir, results, threads=None):
+    """
+    Runs QUAST once on multiple assemblies (which all use the given reference) and puts the
+    metrics into each assembly's TestResult.
+    """
+    quast_dir = tempfile.mkdtemp(prefix='QUAST_TEMP_' + str(os.getpid()) + '_', dir=out_dir)
+
+    quast_command = ['quast.py'] + fastas
+    if reference:
+        quast_command += ['-R', reference]
+
+    # Labels are only for QUAST's output - the report columns are matched to assemblies by order.
+    labels = [os.path.basename(x).split('.fasta')[0].replace(',', '') for x in fastas]
+    quast_command += ['-o', quast_dir, '-l', ','.join(labels), '--no-plots', '--strict-NA']
+    if threads is not None:
+        quast_command += ['--threads', str(threads)]
+    print()
+    print(' '.join(quast_command), flush=True)
+    process = subprocess.Popen(quast_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, _ = process.communicate()
+
+    load_quast_report(os.path.join(quast_dir, 'report.tsv'), results)
+    shutil.rmtree(quast_dir)
+
+
+def load_quast_report(report_filename, results):
+    """
+    Reads a QUAST report.tsv, where the first column holds metric names and each following column
+    holds one assembly's values (in the same order as the results list).
+    """
+    with open(report_filename, 'rt') as quast_report:
+        for line in quast_report:
+            line_parts = line.strip().split('\t')
+            if line_parts[0] == 'Assembly':  # header line
+                continue
+            if not line_parts:
+                continue
+            for i, result in enumerate(results):
+                if line_parts[0] in result.results and i + 1 < len(line_parts):
+                    result.results[line_parts[0]] = line_parts[i + 1]
+
+
+class QuastBatcher(object):
+    """
+    Queues harvested assemblies for QUAST in the output directory, as one small JSON record per
+    assembly, so the queue is shared by every run and worker using that directory and survives a
+    crash. When a reference has batch_size assemblies queued (or when flushed), QUAST is run on
+    them together, and each one is loaded (load_function) and finished (finish_function). Queued
+    assemblies are claimed with a lock on their record, so no two runs evaluate the same one.
+    """
+    def __init__(self, out_dir, batch_size, threads, load_function, finish_function):
+        self.out_dir = out_dir
+        self.queue_dir = get_quast_queue_dir(out_dir)
+        self.batch_size = batch_size
+        self.threads = threads
+        self.load_function = load_function
+        self.finish_function = finish_function
+
+    def queue(self, record):
+        """
+        Saves an assembly's record, a dictionary which needs at least its FASTA ('fasta') and
+        reference ('reference').
+        """
+        os.makedirs(self.queue_dir, exist_ok=True)
+        temp_fd, temp_filename = tempfile.mkstemp(dir=self.queue_dir, prefix='.queue_')
+        with os.fdopen(temp_fd, 'wt') as temp_file:
+            json.dump(record, temp_file, indent=1)
+        os.replace(temp_filename, get_quast_queue_filename(self.out_dir, record['fasta']))
+
+    def run_full_batch(self, reference):
+        self.run_batches(reference, partial=False)
+
+    def flush(self):
+        self.run_batches(None, partial=True)
+
+    def run_batches(self, reference, partial):
+        """
+        Runs QUAST on each reference's queued assemblies (only the given reference's, if there is
+        one) if there are at least batch_size of them, or any at all if partial.
+        """
+        claimed = self.claim(reference)
+        try:
+            batches = OrderedDict()
+            for queue_file, record in claimed:
+                batches.setdefault(record['reference'], []).append((queue_file, record))
+            for batch in batches.values():
+                if partial or len(batch) >= self.batch_size:
+                    self.run_batch(batch)
+        finally:
+            for queue_file, _ in claimed:
+                queue_file.close()  # unlocks any assemblies left queued
+
+    def claim(self, reference=None):
+        """
+        Returns (locked record file, record) for each queued assembly (with the given reference,
+        if there is one) which no other run has claimed.
+        """
+        try:
+            names = sorted(x for x in os.listdir(self.queue_dir) if x.endswith('.json'))
+        except FileNotFoundError:
+            return []
+        claimed = []
+        for name in names:
+            filename = os.path.join(self.queue_dir, name)
+            try:
+                queue_file = open(filename, 'rt')
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(queue_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                # Another run may have finished it (and removed its record) in the meantime.
+                if os.stat(filename).st_ino != os.fstat(queue_file.fileno()).st_ino:
+                    raise FileNotFoundError(filename)
+                record = json.load(queue_file, object_pairs_hook=OrderedDict)
+            except OSError:
+                queue_file.close()
+                continue
+            if reference is not None and record['reference'] != reference:
+                queue_file.close()
+                continue
+            claimed.append((queue_file, record))
+        return claimed
+
+    def run_batch(self, batch):
+        harvested_list = [self.load_function(x[1]) for x in batch]
+        run_batched_quast([x[1]['fasta'] for x in batch], batch[0][1]['reference'],
+                          self.out_dir, [x.result for x in harvested_list], self.threads)
+        for (queue_file, _), harvested in zip(batch, harvested_list):
+            self.finish_function(harvested)
+            os.remove(queue_file.name)
+            queue_file.close()
+
+
+def get_quast_queue_dir(out_dir):
+    return os.path.join(out_dir, QUAST_QUEUE_DIR_NAME)
+
+
+def get_quast_queue_filename(out_dir, fasta):
+    """
+    The queue record for an assembly, named by its FASTA without the extension(s).
+    """
+    return os.path.join(get_quast_queue_dir(out_dir),
+                        os.path.basename(fasta).split('.fasta')[0] + '.json')
+
+
+def is_quast_queued(out_dir, fasta):
+    return os.path.isfile(get_quast_queue_filename(out_dir, fasta))
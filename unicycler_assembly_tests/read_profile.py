@@ -0,0 +1,184 @@
+"""
+Read file statistics (read count, total bases, length distribution and mean quality), built
+with one streaming pass over each FASTQ and saved in a small sidecar profile file. Later runs
+then use the profile instead of reading the file again.
+
+The sidecar goes next to the reads (<reads>.profile) or, if that directory isn't writable, in
+the cache directory. Profiles are keyed by the read file's fingerprint, so a profile is rebuilt
+if the file changes.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import collections
+import gzip
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from unicycler_assembly_tests.misc import get_compression_type
+from unicycler_assembly_tests.result_cache import get_file_fingerprint
+
+
+PROFILE_HEADER = '# read profile v1'
+CHUNK_SIZE = 4194304
+
+loaded_profiles = {}
+loaded_profiles_lock = threading.Lock()
+
+
+class ReadProfile(object):
+    def __init__(self, read_count=0, base_count=0, min_length=0, max_length=0, n50=0,
+                 mean_quality=0.0):
+        self.read_count = read_count
+        self.base_count = base_count
+        self.min_length = min_length
+        self.max_length = max_length
+        self.n50 = n50
+        self.mean_quality = mean_quality
+
+
+def get_read_profiles(read_filenames, cache_dir=None, processes=1):
+    """
+    Returns a dictionary of read filename to ReadProfile. Files without a saved profile are
+    profiled in parallel, one per process.
+    """
+    profiles = {}
+    missing = []
+    for read_filename in read_filenames:
+        profile = load_read_profile(read_filename, cache_dir)
+        if profile is None:
+            missing.append(read_filename)
+        else:
+            profiles[read_filename] = profile
+    if missing:
+        print('Profiling ' + str(len(missing)) + ' read file' +
+              ('' if len(missing) == 1 else 's'), flush=True)
+        with ProcessPoolExecutor(max_workers=max(1, min(processes, len(missing)))) as executor:
+            for read_filename, profile in zip(missing, executor.map(build_read_profile,
+                                                                    missing)):
+                fingerprint = get_file_fingerprint(read_filename)
+                for profile_filename in get_profile_filenames(read_filename, fingerprint,
+                                                              cache_dir):
+                    if save_profile(profile_filename, fingerprint, profile):
+                        break
+                with loaded_profiles_lock:
+                    loaded_profiles[os.path.abspath(read_filename)] = (fingerprint, profile)
+                profiles[read_filename] = profile
+    return profiles
+
+
+def get_read_profile(read_filename, cache_dir=None):
+    return get_read_profiles([read_filename], cache_dir)[read_filename]
+
+
+def load_read_profile(read_filename, cache_dir=None):
+    """
+    Returns the file's ReadProfile from memory or its sidecar, or None if it has neither.
+    """
+    read_filename = os.path.abspath(read_filename)
+    fingerprint = get_file_fingerprint(read_filename)
+    with loaded_profiles_lock:
+        if read_filename in loaded_profiles and loaded_profiles[read_filename][0] == fingerprint:
+            return loaded_profiles[read_filename][1]
+    for profile_filename in get_profile_filenames(read_filename, fingerprint, cache_dir):
+        profile = load_profile(profile_filename, fingerprint)
+        if profile is not None:
+            with loaded_profiles_lock:
+                loaded_profiles[read_filename] = (fingerprint, profile)
+            return profile
+    return None
+
+
+def get_profile_filenames(read_filename, fingerprint, cache_dir):
+    profile_filenames = [read_filename + '.profile']
+    if cache_dir is not None:
+        profile_filenames.append(os.path.join(cache_dir, 'read_profiles',
+                                              fingerprint + '.profile'))
+    return profile_filenames
+
+
+def build_read_profile(read_filename):
+    """
+    Streams through a FASTQ in large chunks, splitting each into lines and taking every fourth
+    line (from the right offset) as sequences and qualities. Assumes four-line FASTQ records.
+    """
+    if get_compression_type(read_filename) == 'gz':
+        open_func = gzip.open
+    else:  # plain text
+        open_func = open
+
+    lengths = collections.Counter()
+    quality_sum, quality_count = 0, 0
+    line_number = 0
+    leftover = b''
+    with open_func(read_filename, 'rb') as fastq:
+        while True:
+            chunk = fastq.read(CHUNK_SIZE)
+            if chunk:
+                lines = (leftover + chunk).split(b'\n')
+                leftover = lines.pop()
+            elif leftover:
+                lines, leftover = [leftover], b''
+            else:
+                break
+            offset = line_number % 4
+            lengths.update(map(len, lines[(1 - offset) % 4::4]))
+            qualities = lines[(3 - offset) % 4::4]
+            quality_sum += sum(map(sum, qualities))
+            quality_count += sum(map(len, qualities))
+            line_number += len(lines)
+
+    profile = ReadProfile()
+    profile.read_count = sum(lengths.values())
+    profile.base_count = sum(x * y for x, y in lengths.items())
+    if lengths:
+        profile.min_length, profile.max_length = min(lengths), max(lengths)
+        running_total = 0
+        for length in sorted(lengths, reverse=True):
+            running_total += length * lengths[length]
+            if running_total * 2 >= profile.base_count:
+                profile.n50 = length
+                break
+    if quality_count:
+        profile.mean_quality = quality_sum / quality_count - 33.0
+    return profile
+
+
+def load_profile(profile_filename, fingerprint):
+    """
+    Returns the ReadProfile from a profile file, or None if it is missing or out of date.
+    """
+    try:
+        with open(profile_filename, 'rt') as profile_file:
+            lines = profile_file.read().splitlines()
+    except OSError:
+        return None
+    if len(lines) != 3 or lines[0] != PROFILE_HEADER or lines[1] != fingerprint:
+        return None
+    try:
+        parts = lines[2].split('\t')
+        return ReadProfile(int(parts[0]), int(parts[1]), int(parts[2]), int(parts[3]),
+                           int(parts[4]), float(parts[5]))
+    except (IndexError, ValueError):
+        return None
+
+
+def save_profile(profile_filename, fingerprint, profile):
+    """
+    Writes the profile file atomically, returning whether it succeeded.
+    """
+    values = [profile.read_count, profile.base_count, profile.min_length, profile.max_length,
+              profile.n50, '%.3f' % profile.mean_quality]
+    profile_dir = os.path.dirname(profile_filename)
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        temp_fd, temp_filename = tempfile.mkstemp(dir=profile_dir, prefix='.profile_')
+        with os.fdopen(temp_fd, 'wt') as temp_file:
+            temp_file.write(PROFILE_HEADER + '\n' + fingerprint + '\n' +
+                            '\t'.join(str(x) for x in values) + '\n')
+        os.replace(temp_filename, profile_filename)
+    except OSError:
+        return False
+    return True
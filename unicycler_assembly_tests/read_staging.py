@@ -0,0 +1,138 @@
+"""
+Stages read files to a local scratch directory (e.g. an SSD or tmpfs), so assemblers read them
+from there instead of from the (possibly networked) read directory. Reads can also be
+decompressed while staging, so each assembler doesn't have to decompress them itself.
+
+Staged files are named by a fingerprint of their contents, so a file is only staged once no
+matter how many read sets, jobs or assembler_comparison processes use it. Each user holds a
+shared flock on the staged file's lock file, which acts as a reference count: a staged file is
+only removed when an exclusive lock can be taken, i.e. when no one else is using it. Users of a
+file which is already staged only ever take the shared lock, so they never wait on each other.
+A missing file is staged under a separate staging lock, so only one user copies it.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import copy
+import fcntl
+import gzip
+import os
+import shutil
+import tempfile
+from unicycler_assembly_tests.misc import get_compression_type
+from unicycler_assembly_tests.result_cache import get_file_fingerprint
+
+
+STAGED_READS_DIR_NAME = 'staged_reads'
+
+
+class StagedFile(object):
+    def __init__(self, source, scratch_dir, decompress=False):
+        self.source = source
+        self.decompress = decompress and get_compression_type(source) == 'gz'
+        self.dir = os.path.join(scratch_dir, STAGED_READS_DIR_NAME, get_file_fingerprint(source))
+        name = os.path.basename(source)
+        if self.decompress and name.endswith('.gz'):
+            name = name[:-3]
+        self.filename = os.path.join(self.dir, name)
+        self.lock_filename = os.path.join(self.dir, 'lock')
+        self.staging_lock_filename = os.path.join(self.dir, 'staging.lock')
+        self.lock_file = None
+
+    def acquire(self):
+        """
+        Takes a reference to the file, staging it first if it isn't already. The reference (a
+        shared lock) is taken before staging, so the file can't be removed in the meantime.
+        """
+        lock_file = self.open_lock_file(fcntl.LOCK_SH)
+        try:
+            if not os.path.isfile(self.filename):
+                with open(self.staging_lock_filename, 'ab') as staging_lock_file:
+                    fcntl.flock(staging_lock_file, fcntl.LOCK_EX)
+                    if not os.path.isfile(self.filename):  # not staged by another user meanwhile
+                        self.stage()
+        except BaseException:
+            lock_file.close()
+            raise
+        self.lock_file = lock_file
+
+    def open_lock_file(self, operation):
+        """
+        Opens and locks the lock file. If it was removed (along with the staged file) while
+        waiting for the lock, this tries again with a new one.
+        """
+        while True:
+            os.makedirs(self.dir, exist_ok=True)
+            try:
+                lock_file = open(self.lock_filename, 'ab')
+            except FileNotFoundError:
+                continue
+            fcntl.flock(lock_file, operation)
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(self.lock_filename).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    def stage(self):
+        print('Staging ' + self.source + ' -> ' + self.filename, flush=True)
+        temp_fd, temp_filename = tempfile.mkstemp(dir=self.dir, prefix='.staging_')
+        try:
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                if self.decompress:
+                    with gzip.open(self.source, 'rb') as source_file:
+                        shutil.copyfileobj(source_file, temp_file, 4194304)
+                else:
+                    with open(self.source, 'rb') as source_file:
+                        shutil.copyfileobj(source_file, temp_file, 4194304)
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+    def release(self, remove_unused=False):
+        """
+        Drops this reference. If remove_unused is set and there are no other references, the
+        staged file is removed.
+        """
+        if self.lock_file is None:
+            return
+        lock_file, self.lock_file = self.lock_file, None
+        try:
+            if remove_unused:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:  # still in use
+                    return
+                shutil.rmtree(self.dir, ignore_errors=True)
+        finally:
+            lock_file.close()
+
+
+def stage_read_set(read_set, scratch_dir, decompress=False):
+    """
+    Returns a copy of the read set which uses staged read files, and the list of StagedFiles
+    (which must be released when the assembly is done).
+    """
+    staged_read_set = copy.copy(read_set)
+    staged_files = []
+    try:
+        for attribute in ['short_reads_1', 'short_reads_2', 'long_reads']:
+            source = getattr(read_set, attribute)
+            if source is None:
+                continue
+            staged_file = StagedFile(source, scratch_dir, decompress)
+            staged_file.acquire()
+            staged_files.append(staged_file)
+            setattr(staged_read_set, attribute, staged_file.filename)
+    except BaseException:
+        release_staged_files(staged_files)
+        raise
+    return staged_read_set, staged_files
+
+
+def release_staged_files(staged_files, remove_unused=False):
+    for staged_file in staged_files:
+        staged_file.release(remove_unused)
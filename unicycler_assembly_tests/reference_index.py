@@ -0,0 +1,191 @@
+"""
+Reference metadata (name, length, depth, circularity, GC and checksum of each sequence), built
+with one streaming pass over the reference FASTA and saved in a small sidecar index file. Later
+read sets, processes and runs then use the index instead of parsing the reference again.
+
+The sidecar goes next to the reference (<reference>.index) or, if that directory isn't writable,
+in the cache directory. It is rebuilt if the reference's size or modification time changes.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+from unicycler_assembly_tests.misc import get_compression_type
+
+
+INDEX_HEADER = '# reference index v1'
+
+loaded_references = {}
+loaded_references_lock = threading.Lock()
+
+
+class ReferenceRecord(object):
+    def __init__(self, name, length=0, depth=1.0, circular=False, gc_count=0, acgt_count=0,
+                 checksum=''):
+        self.name = name
+        self.length = length
+        self.depth = depth
+        self.circular = circular
+        self.gc_count = gc_count
+        self.acgt_count = acgt_count
+        self.checksum = checksum
+
+
+class ReferenceInfo(object):
+    def __init__(self, records):
+        self.records = records
+
+    def get_lengths(self):
+        return [x.length for x in self.records]
+
+    def get_total_length(self):
+        return sum(self.get_lengths())
+
+    def get_expected_linear_seqs(self):
+        return sum(0 if x.circular else 1 for x in self.records)
+
+    def get_gc(self):
+        """
+        GC content (%) of the whole reference, ignoring non-ACGT bases (like QUAST does).
+        """
+        acgt_count = sum(x.acgt_count for x in self.records)
+        if acgt_count == 0:
+            return 0.0
+        return 100.0 * sum(x.gc_count for x in self.records) / acgt_count
+
+    def get_checksum(self):
+        """
+        A checksum of the reference's sequences, independent of its filename and headers.
+        """
+        return hashlib.md5(','.join(x.checksum for x in self.records).encode()).hexdigest()
+
+
+def get_reference_info(reference, cache_dir=None):
+    """
+    Returns the ReferenceInfo for a reference FASTA, using (or making) its index file.
+    """
+    reference = os.path.abspath(reference)
+    stat = os.stat(reference)
+    file_id = str(stat.st_size) + '\t' + '%.6f' % stat.st_mtime
+    with loaded_references_lock:
+        if reference in loaded_references and loaded_references[reference][0] == file_id:
+            return loaded_references[reference][1]
+
+    info = None
+    index_filenames = get_index_filenames(reference, cache_dir)
+    for index_filename in index_filenames:
+        info = load_index(index_filename, file_id)
+        if info is not None:
+            break
+    if info is None:
+        info = build_reference_info(reference)
+        for index_filename in index_filenames:
+            if save_index(index_filename, file_id, info):
+                break
+
+    with loaded_references_lock:
+        loaded_references[reference] = (file_id, info)
+    return info
+
+
+def get_index_filenames(reference, cache_dir):
+    index_filenames = [reference + '.index']
+    if cache_dir is not None:
+        path_hash = hashlib.md5(reference.encode()).hexdigest()[:12]
+        index_filenames.append(os.path.join(cache_dir, 'references',
+                                            os.path.basename(reference) + '.' + path_hash +
+                                            '.index'))
+    return index_filenames
+
+
+def build_reference_info(reference):
+    if get_compression_type(reference) == 'gz':
+        open_func = gzip.open
+    else:  # plain text
+        open_func = open
+
+    records = []
+    record, md5 = None, None
+    with open_func(reference, 'rt') as fasta_file:
+        for line in fasta_file:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '>':  # Header line = start of new sequence
+                if record is not None:
+                    record.checksum = md5.hexdigest()
+                    records.append(record)
+                record, md5 = parse_header(line[1:]), hashlib.md5()
+            elif record is not None:
+                line = line.upper()
+                record.length += len(line)
+                gc_count = line.count('G') + line.count('C')
+                record.gc_count += gc_count
+                record.acgt_count += gc_count + line.count('A') + line.count('T')
+                md5.update(line.encode())
+    if record is not None:
+        record.checksum = md5.hexdigest()
+        records.append(record)
+    return ReferenceInfo(records)
+
+
+def parse_header(header):
+    """
+    Reads the name, depth and circularity from a FASTA header, the same way misc.load_fasta does.
+    """
+    try:
+        depth = float(header.split('depth=')[1].split()[0].replace('x', ''))
+    except (IndexError, ValueError):
+        depth = 1.0
+    circular = 'circular=true' in header.lower()
+    return ReferenceRecord(header.split()[0] if header.split() else '', depth=depth,
+                           circular=circular)
+
+
+def load_index(index_filename, file_id):
+    """
+    Returns the ReferenceInfo from an index file, or None if it is missing or out of date.
+    """
+    try:
+        with open(index_filename, 'rt') as index_file:
+            lines = index_file.read().splitlines()
+    except OSError:
+        return None
+    if len(lines) < 2 or lines[0] != INDEX_HEADER or lines[1] != file_id:
+        return None
+    records = []
+    try:
+        for line in lines[2:]:
+            parts = line.split('\t')
+            records.append(ReferenceRecord(parts[0], int(parts[1]), float(parts[2]),
+                                           parts[3] == 'circular', int(parts[4]), int(parts[5]),
+                                           parts[6]))
+    except (IndexError, ValueError):
+        return None
+    return ReferenceInfo(records)
+
+
+def save_index(index_filename, file_id, info):
+    """
+    Writes the index file atomically, returning whether it succeeded.
+    """
+    lines = [INDEX_HEADER, file_id]
+    for record in info.records:
+        lines.append('\t'.join([record.name, str(record.length), str(record.depth),
+                                'circular' if record.circular else 'linear',
+                                str(record.gc_count), str(record.acgt_count), record.checksum]))
+    index_dir = os.path.dirname(index_filename)
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        temp_fd, temp_filename = tempfile.mkstemp(dir=index_dir, prefix='.index_')
+        with os.fdopen(temp_fd, 'wt') as temp_file:
+            temp_file.write('\n'.join(lines) + '\n')
+        os.replace(temp_filename, index_filename)
+    except OSError:
+        return False
+    return True
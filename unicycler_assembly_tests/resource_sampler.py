@@ -0,0 +1,152 @@
+"""
+A background sampler which periodically walks /proc to record the CPU usage, memory and thread
+count of the assembly command currently running. Each command is started in its own process
+group, so all of its descendants can be found by their process group ID.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import os
+import threading
+import time
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# How often a ProcessTreeMonitor sums a command's memory (when there is no ResourceSampler).
+TREE_MONITOR_INTERVAL = 1.0
+
+
+class ResourceSampler(object):
+    def __init__(self, samples_filename, interval):
+        self.samples_filename = samples_filename
+        self.interval = interval
+        self.pgid = None
+        self.step = 0
+        self.program = ''
+        self.start_time = time.time()
+        self.previous_cpu_ticks = {}
+        self.previous_sample_time = None
+        self.peak_rss = 0.0
+        self.peak_rss_step = ''
+        self.step_peak_rss = {}  # step to the peak RSS (in kB) of its whole process tree
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample_loop)
+        self.thread.daemon = True
+
+    def start(self):
+        with open(self.samples_filename, 'wt') as samples_file:
+            samples_file.write('\t'.join(['Time (s)', 'Step', 'Program', 'CPU (cores)', 'RSS (MB)',
+                                          'Threads']) + '\n')
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def set_command(self, step, command, pgid):
+        """
+        Tells the sampler which command is running (step is 1-based) and its process group.
+        """
+        self.step = step
+        self.program = command.split()[0] if command.split() else ''
+        self.pgid = pgid
+        self.previous_cpu_ticks = {}
+        self.previous_sample_time = None
+
+    def sample_loop(self):
+        while not self.stop_event.wait(self.interval):
+            if self.pgid is not None:
+                self.take_sample()
+
+    def take_sample(self):
+        now = time.time()
+        cpu_ticks, rss, threads = {}, 0, 0
+        for pid, stat in get_process_group_stats(self.pgid):
+            cpu_ticks[pid] = stat[0]
+            rss += stat[1]
+            threads += stat[2]
+        if not cpu_ticks:  # between commands
+            return
+
+        # CPU usage is the CPU time gained since the last sample. Processes which are new since
+        # then count all of their CPU time.
+        if self.previous_sample_time is None:
+            cpu_cores = 0.0
+        else:
+            gained_ticks = sum(max(0, ticks - self.previous_cpu_ticks.get(pid, 0))
+                               for pid, ticks in cpu_ticks.items())
+            elapsed = now - self.previous_sample_time
+            cpu_cores = gained_ticks / CLOCK_TICKS / elapsed if elapsed > 0.0 else 0.0
+        self.previous_cpu_ticks = cpu_ticks
+        self.previous_sample_time = now
+
+        rss_kb = rss * PAGE_SIZE // 1024
+        self.step_peak_rss[self.step] = max(self.step_peak_rss.get(self.step, 0), rss_kb)
+        rss_mb = rss * PAGE_SIZE / 1048576
+        if rss_mb > self.peak_rss:
+            self.peak_rss = rss_mb
+            self.peak_rss_step = str(self.step) + ': ' + self.program
+
+        with open(self.samples_filename, 'at') as samples_file:
+            samples_file.write('%.1f\t%d\t%s\t%.2f\t%.1f\t%d\n' %
+                               (now - self.start_time, self.step, self.program, cpu_cores, rss_mb,
+                                threads))
+
+
+class ProcessTreeMonitor(object):
+    """
+    Tracks the peak total RSS of one command's processes (everything in its process group, summed)
+    by checking /proc every few moments. Used when no ResourceSampler is running.
+    """
+    def __init__(self, pgid, interval=TREE_MONITOR_INTERVAL):
+        self.pgid = pgid
+        self.interval = interval
+        self.peak_rss = 0  # in kB
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.monitor_loop)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops monitoring and returns the peak RSS (in kB).
+        """
+        self.stop_event.set()
+        self.thread.join()
+        return self.peak_rss
+
+    def monitor_loop(self):
+        while True:
+            rss = sum(x[1][1] for x in get_process_group_stats(self.pgid))
+            self.peak_rss = max(self.peak_rss, rss * PAGE_SIZE // 1024)
+            if self.stop_event.wait(self.interval):
+                return
+
+
+def get_process_group_stats(pgid):
+    """
+    Yields (pid, (cpu_ticks, rss_pages, thread_count)) for every process in the process group.
+    """
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/' + pid + '/stat', 'rt') as stat_file:
+                stat = stat_file.read()
+        except OSError:  # the process ended
+            continue
+
+        # The process name is in brackets and may contain spaces, so split after it.
+        fields = stat[stat.rfind(')') + 2:].split()
+        try:
+            if int(fields[2]) != pgid:
+                continue
+            cpu_ticks = int(fields[11]) + int(fields[12])
+            yield int(pid), (cpu_ticks, int(fields[21]), int(fields[17]))
+        except (IndexError, ValueError):
+            continue
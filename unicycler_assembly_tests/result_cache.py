@@ -0,0 +1,127 @@
+"""
+A content-addressed cache of finished assemblies and their evaluations.
+
+The key comes from what actually determines an assembly: fingerprints of the read files and
+reference (not their paths), the fully substituted commands (with read paths replaced by their
+fingerprints), the assembler, setting and version, and how the assembly was evaluated. So
+renaming or moving reads, or using a new out_dir, still finds the cached assembly, while editing
+a command file gives a new key.
+
+Each entry is a directory in <cache_dir>/results holding the result row (as JSON) and the
+assembly's files from the output directory. Entries are made in a temporary directory and then
+renamed into place, so runs (or machines) sharing a cache directory never see partial entries.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+FINGERPRINT_CHUNK_SIZE = 1048576
+RESULT_FILENAME = 'result.json'
+
+fingerprints = {}
+fingerprints_lock = threading.Lock()
+
+
+def get_file_fingerprint(filename):
+    """
+    A quick fingerprint of a file's contents: its size and an MD5 of its first and last MB.
+    Fingerprints are remembered for as long as the file's size and modification time don't
+    change.
+    """
+    filename = os.path.realpath(filename)
+    stat = os.stat(filename)
+    file_id = (stat.st_size, stat.st_mtime)
+    with fingerprints_lock:
+        if filename in fingerprints and fingerprints[filename][0] == file_id:
+            return fingerprints[filename][1]
+
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as data_file:
+        md5.update(data_file.read(FINGERPRINT_CHUNK_SIZE))
+        if stat.st_size > FINGERPRINT_CHUNK_SIZE:
+            data_file.seek(max(FINGERPRINT_CHUNK_SIZE, stat.st_size - FINGERPRINT_CHUNK_SIZE))
+            md5.update(data_file.read(FINGERPRINT_CHUNK_SIZE))
+    fingerprint = str(stat.st_size) + '-' + md5.hexdigest()
+
+    with fingerprints_lock:
+        fingerprints[filename] = (file_id, fingerprint)
+    return fingerprint
+
+
+def get_result_cache_key(read_files, reference, commands, assembler_details, eval_mode):
+    """
+    Returns the cache key (a hex digest). The read files are replaced in the commands by their
+    fingerprints, so the key doesn't depend on where they are.
+    """
+    key_parts = ['reads'] + [get_file_fingerprint(x) for x in read_files]
+    key_parts += ['reference', get_file_fingerprint(reference) if reference else 'none']
+    key_parts.append('commands')
+    for command in commands:
+        for read_file in read_files:
+            command = command.replace(read_file, get_file_fingerprint(read_file))
+        key_parts.append(command)
+    key_parts += ['assembler'] + list(assembler_details)
+    key_parts += ['evaluation', eval_mode]
+    return hashlib.sha256('\n'.join(key_parts).encode()).hexdigest()
+
+
+def get_entry_dir(cache_dir, cache_key):
+    return os.path.join(cache_dir, 'results', cache_key[:2], cache_key)
+
+
+def has_cached_result(cache_dir, cache_key):
+    return os.path.isfile(os.path.join(get_entry_dir(cache_dir, cache_key), RESULT_FILENAME))
+
+
+def load_cached_result(cache_dir, cache_key, out_dir, file_prefix):
+    """
+    If the cache has this key, its files are copied to the output directory (named with the
+    given prefix) and its result is returned (as an OrderedDict of column to value). Otherwise
+    returns None.
+    """
+    entry_dir = get_entry_dir(cache_dir, cache_key)
+    try:
+        with open(os.path.join(entry_dir, RESULT_FILENAME), 'rt') as result_file:
+            results = json.load(result_file, object_pairs_hook=OrderedDict)
+        for suffix in os.listdir(entry_dir):
+            if suffix != RESULT_FILENAME:
+                shutil.copy(os.path.join(entry_dir, suffix),
+                            os.path.join(out_dir, file_prefix + suffix))
+    except (OSError, ValueError):
+        return None
+    return results
+
+
+def save_cached_result(cache_dir, cache_key, results, out_dir, file_prefix):
+    """
+    Adds an entry to the cache holding the result (a dictionary of column to value) and the
+    files in the output directory which start with the prefix. Does nothing if the entry already
+    exists or can't be made.
+    """
+    entry_dir = get_entry_dir(cache_dir, cache_key)
+    if os.path.isdir(entry_dir):
+        return
+    try:
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir), prefix='.entry_')
+    except OSError:
+        return
+    try:
+        for filename in os.listdir(out_dir):
+            if filename.startswith(file_prefix):
+                shutil.copy(os.path.join(out_dir, filename),
+                            os.path.join(temp_dir, filename[len(file_prefix):]))
+        with open(os.path.join(temp_dir, RESULT_FILENAME), 'wt') as result_file:
+            json.dump(results, result_file, indent=1)
+        os.rename(temp_dir, entry_dir)
+    except OSError:  # e.g. another run saved the same entry first
+        shutil.rmtree(temp_dir, ignore_errors=True)
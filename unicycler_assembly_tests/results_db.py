@@ -0,0 +1,176 @@
+"""
+A SQLite store for assembly results, an alternative to appending lines to results.tsv.
+
+Each assembly (read set, assembler, setting, version and threads) has at most one row: writing a
+result replaces any earlier one (e.g. from a failed attempt), so there are no duplicate lines. The
+database is in WAL mode, so concurrent jobs and processes can read it while another writes. Each
+thread keeps one connection to it. results.tsv is exported from it on demand (at the start and end
+of a run), not after every result.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+RESULTS_DB_FILENAME = 'results.sqlite'
+KEY_COLUMNS = ['Read set name', 'Assembler', 'Assembler setting/output', 'Assembler version',
+               'Threads']
+
+# Each thread's open connections, by database filename.
+thread_connections = threading.local()
+
+
+class ResultsDatabase(object):
+    def __init__(self, filename, columns):
+        self.filename = filename
+        self.columns = list(columns)
+
+    def connect(self):
+        """
+        Returns this thread's connection to the database, opening it the first time.
+        """
+        connections = getattr(thread_connections, 'connections', None)
+        if connections is None:
+            connections = thread_connections.connections = {}
+        connection = connections.get(self.filename)
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=600.0)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connections[self.filename] = connection
+        return connection
+
+    def create(self):
+        """
+        Makes the results table and its indexes if they don't exist yet. Returns False if the
+        table exists but has different columns.
+        """
+        connection = self.connect()
+        with connection:
+            existing_columns = self.get_existing_columns(connection)
+            if existing_columns:
+                return existing_columns == self.columns
+            self.create_table(connection)
+        return True
+
+    def get_existing_columns(self, connection):
+        return [x[1] for x in connection.execute('PRAGMA table_info(results)')]
+
+    def create_table(self, connection):
+        column_defs = ', '.join(quote(x) + " TEXT NOT NULL DEFAULT ''" for x in self.columns)
+        key = ', '.join(quote(x) for x in KEY_COLUMNS)
+        connection.execute('CREATE TABLE results (' + column_defs + ', UNIQUE (' + key + '))')
+        for i, column in enumerate(KEY_COLUMNS):
+            connection.execute('CREATE INDEX results_key_' + str(i) +
+                               ' ON results (' + quote(column) + ')')
+
+    def migrate(self):
+        """
+        Rebuilds a results table made by an older version of assembler_comparison with these
+        columns, copying its values by column name and leaving new columns empty. If the old
+        table has columns which these don't, it is kept (renamed) and its new name is returned.
+        """
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            old_columns = self.get_existing_columns(connection)
+            if old_columns == self.columns:  # another process migrated it first
+                return None
+            connection.execute('ALTER TABLE results RENAME TO results_migrating')
+            for i in range(len(KEY_COLUMNS)):
+                connection.execute('DROP INDEX IF EXISTS results_key_' + str(i))
+            self.create_table(connection)
+            shared_columns = ', '.join(quote(x) for x in self.columns if x in old_columns)
+            connection.execute('INSERT OR REPLACE INTO results (' + shared_columns + ') SELECT ' +
+                               shared_columns + ' FROM results_migrating ORDER BY rowid')
+            if all(x in self.columns for x in old_columns):
+                connection.execute('DROP TABLE results_migrating')
+                return None
+            old_table = 'results_before_' + str(int(time.time()))
+            connection.execute('ALTER TABLE results_migrating RENAME TO ' + old_table)
+            return old_table
+
+    def is_empty(self):
+        connection = self.connect()
+        return connection.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 0
+
+    def write_results(self, results_list):
+        """
+        Inserts results (dictionaries of column to value), each replacing any existing row for
+        the same assembly. They are written in one transaction.
+        """
+        insert = 'INSERT OR REPLACE INTO results (' + \
+            ', '.join(quote(x) for x in self.columns) + ') VALUES (' + \
+            ', '.join('?' for _ in self.columns) + ')'
+        connection = self.connect()
+        with connection:
+            connection.executemany(insert, [[str(x.get(c, '')) for c in self.columns]
+                                            for x in results_list])
+
+    def write_result(self, results):
+        self.write_results([results])
+
+    def get_successful_read_sets(self, assembler, setting, version=None, threads=None):
+        """
+        Returns the names of the read sets successfully assembled with this assembler and
+        setting (and version and thread count, if given).
+        """
+        query = 'SELECT ' + quote('Read set name') + ' FROM results WHERE ' + \
+            quote('Assembler') + ' = ? AND ' + quote('Assembler setting/output') + ' = ? AND ' + \
+            quote('Assembly result') + " = 'success'"
+        parameters = [assembler, setting]
+        if version is not None:
+            query += ' AND ' + quote('Assembler version') + ' = ?'
+            parameters.append(version)
+        if threads is not None:
+            query += ' AND ' + quote('Threads') + ' = ?'
+            parameters.append(str(threads))
+        connection = self.connect()
+        return set(x[0] for x in connection.execute(query, parameters))
+
+    def is_done(self, read_set_name, assembler, setting, version, threads):
+        query = 'SELECT 1 FROM results WHERE ' + \
+            ' AND '.join(quote(x) + ' = ?' for x in KEY_COLUMNS) + ' AND ' + \
+            quote('Assembly result') + " = 'success' LIMIT 1"
+        connection = self.connect()
+        return connection.execute(query, [read_set_name, assembler, setting, version,
+                                          str(threads)]).fetchone() is not None
+
+    def export_tsv(self, tsv_filename):
+        """
+        Writes all results to a TSV file (replacing it atomically), in the order they were
+        written.
+        """
+        rows = self.connect().execute('SELECT ' + ', '.join(quote(x) for x in self.columns) +
+                                      ' FROM results ORDER BY rowid')
+        temp_fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(tsv_filename),
+                                                  prefix='.results_')
+        with os.fdopen(temp_fd, 'wt') as tsv_file:
+            tsv_file.write('\t'.join(self.columns) + '\n')
+            for row in rows:
+                tsv_file.write('\t'.join(row) + '\n')
+        os.replace(temp_filename, tsv_filename)
+
+    def import_tsv(self, tsv_filename):
+        """
+        Loads the rows of an existing results table. Later rows replace earlier ones for the same
+        assembly, so duplicate lines from failed runs are merged.
+        """
+        results_list = []
+        with open(tsv_filename, 'rt') as tsv_file:
+            headers = tsv_file.readline().rstrip('\n').split('\t')
+            for line in tsv_file:
+                values = line.rstrip('\n').split('\t')
+                if len(values) == len(headers):
+                    results_list.append(dict(zip(headers, values)))
+        self.write_results(results_list)
+        return len(results_list)
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,122 @@
+"""
+A simple job scheduler which runs several assembly jobs at once, packing them into a declared
+budget of CPU cores and memory.
+
+Each job runs in its own thread. The heavy lifting is done by the assembler subprocesses, so the
+threads themselves spend nearly all of their time waiting.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import os
+import threading
+import traceback
+
+
+class Job(object):
+    def __init__(self, name, function, args, cores=1, mem=0.0):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.cores = cores
+        self.mem = mem  # in GB
+        self.thread = None
+
+    def __repr__(self):
+        return self.name + ' (' + str(self.cores) + ' cores, ' + '%.1f' % self.mem + ' GB)'
+
+
+class ResourceScheduler(object):
+    """
+    Runs jobs concurrently, never exceeding the job count, core count or memory budget. Jobs are
+    started in the order they were submitted, except that a smaller job can start ahead of a
+    larger one if the larger one doesn't currently fit.
+    """
+    def __init__(self, max_jobs, max_cores, max_mem):
+        self.max_jobs = max_jobs
+        self.max_cores = max_cores
+        self.max_mem = max_mem
+        self.pending = []
+        self.running = []
+        self.failed = []
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def submit(self, job):
+        # A job bigger than the whole budget could never start, so it is trimmed to fit (it will
+        # then run on its own).
+        job.cores = min(job.cores, self.max_cores)
+        job.mem = min(job.mem, self.max_mem)
+        with self.condition:
+            self.pending.append(job)
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        Indicates that no more jobs will be submitted, so run() can return when they are done.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def run(self):
+        """
+        Runs submitted jobs (including any submitted while running) and returns once close() has
+        been called and they have all finished.
+        """
+        with self.condition:
+            while self.pending or self.running or not self.closed:
+                job = self.get_next_job()
+                if job is None:
+                    self.condition.wait()
+                else:
+                    self.start_job(job)
+
+    def get_next_job(self):
+        if len(self.running) >= self.max_jobs:
+            return None
+        free_cores = self.max_cores - sum(x.cores for x in self.running)
+        free_mem = self.max_mem - sum(x.mem for x in self.running)
+        for job in self.pending:
+            if job.cores <= free_cores and job.mem <= free_mem:
+                self.pending.remove(job)
+                return job
+        return None
+
+    def start_job(self, job):
+        self.running.append(job)
+        job.thread = threading.Thread(target=self.run_job, args=(job,), name=job.name)
+        job.thread.daemon = True
+        job.thread.start()
+
+    def run_job(self, job):
+        try:
+            job.function(*job.args)
+        except (Exception, SystemExit):
+            # sys.exit() inside a thread would otherwise end the thread silently.
+            print('Job failed: ' + job.name, flush=True)
+            traceback.print_exc()
+            with self.condition:
+                self.failed.append(job)
+        finally:
+            with self.condition:
+                self.running.remove(job)
+                self.condition.notify_all()
+
+
+def get_total_memory():
+    """
+    Returns the total system memory in GB (or 0.0 if it can't be determined).
+    """
+    try:
+        with open('/proc/meminfo', 'rt') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) / 1048576.0
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1073741824.0
+    except (ValueError, OSError, AttributeError):
+        return 0.0
@@ -0,0 +1,123 @@
+"""
+A content-addressed cache of individual pipeline steps, so a step shared by several read sets
+(e.g. npScarf's SPAdes assembly of the short reads, which is the same for every long read set)
+is only run once, and a rerun of an interrupted or failed pipeline resumes after its last
+completed step.
+
+Only commands which declare their output in the command file (e.g. 'spades.py ... -o
+spades_assembly  # output=spades_assembly') are cached. A step's key chains the key of the step
+before it with the step's command (with read paths replaced by their fingerprints) and the
+program's path and modification time, so a step is only reused when everything leading up to it
+is the same. Each entry is a snapshot of the step's outputs in <cache_dir>/steps, made in a
+temporary directory and then renamed into place.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from unicycler_assembly_tests.command_runner import get_program_name
+from unicycler_assembly_tests.result_cache import get_file_fingerprint
+from unicycler_assembly_tests.version_cache import get_version_cache_key
+
+
+STEP_FILENAME = 'step.json'
+OUTPUTS_DIR_NAME = 'outputs'
+
+
+def get_step_keys(commands, read_files):
+    """
+    Returns the cache key (a hex digest) for each command.
+    """
+    step_keys = []
+    previous_key = ''
+    for command in commands:
+        for read_file in read_files:
+            command = command.replace(read_file, get_file_fingerprint(read_file))
+        program = get_program_name(command)
+        key_parts = [previous_key, command, get_version_cache_key(program) or program]
+        previous_key = hashlib.sha256('\n'.join(key_parts).encode()).hexdigest()
+        step_keys.append(previous_key)
+    return step_keys
+
+
+def get_entry_dir(cache_dir, step_key):
+    return os.path.join(cache_dir, 'steps', step_key[:2], step_key)
+
+
+def lock_step(cache_dir, step_key):
+    """
+    Takes an exclusive lock on the step (held until the returned file is closed), so identical
+    steps in concurrent jobs run one at a time and the later ones can use the first's snapshot.
+    """
+    entry_dir = get_entry_dir(cache_dir, step_key)
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    lock_file = open(entry_dir + '.lock', 'ab')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def restore_step(cache_dir, step_key, assembly_dir):
+    """
+    If the cache has this step, its outputs are copied into the assembly directory and its
+    original details (a dictionary with the command and its resource use) are returned.
+    Otherwise returns None.
+    """
+    entry_dir = get_entry_dir(cache_dir, step_key)
+    try:
+        with open(os.path.join(entry_dir, STEP_FILENAME), 'rt') as step_file:
+            step = json.load(step_file)
+        outputs_dir = os.path.join(entry_dir, OUTPUTS_DIR_NAME)
+        for output in step['outputs']:
+            source = os.path.join(outputs_dir, output)
+            dest = os.path.join(assembly_dir, output)
+            if os.path.isdir(dest):
+                shutil.rmtree(dest)
+            if os.path.isdir(source):
+                shutil.copytree(source, dest, symlinks=True)
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copy2(source, dest)
+    except (OSError, ValueError, KeyError):
+        return None
+    return step
+
+
+def save_step(cache_dir, step_key, assembly_dir, outputs, command_result):
+    """
+    Snapshots the step's outputs (paths relative to the assembly directory) into the cache. Does
+    nothing if the entry already exists, an output is missing or the entry can't be made.
+    """
+    entry_dir = get_entry_dir(cache_dir, step_key)
+    if os.path.isdir(entry_dir):
+        return
+    if not all(os.path.exists(os.path.join(assembly_dir, x)) for x in outputs):
+        return
+    try:
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir), prefix='.entry_')
+    except OSError:
+        return
+    try:
+        outputs_dir = os.path.join(temp_dir, OUTPUTS_DIR_NAME)
+        for output in outputs:
+            source = os.path.join(assembly_dir, output)
+            dest = os.path.join(outputs_dir, output)
+            if os.path.isdir(source):
+                shutil.copytree(source, dest, symlinks=True)
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copy2(source, dest)
+        step = {'command': command_result.command, 'outputs': outputs,
+                'wall_time': command_result.wall_time, 'user_time': command_result.user_time,
+                'sys_time': command_result.sys_time, 'max_rss': command_result.max_rss}
+        with open(os.path.join(temp_dir, STEP_FILENAME), 'wt') as step_file:
+            json.dump(step, step_file, indent=1)
+        os.rename(temp_dir, entry_dir)
+    except OSError:  # e.g. another run saved the same entry first
+        shutil.rmtree(temp_dir, ignore_errors=True)
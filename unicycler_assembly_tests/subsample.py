@@ -0,0 +1,110 @@
+"""
+A streaming read subsampler for depth-scaling studies. Each read file is read once and written
+to several depth-reduced copies at the same time.
+
+Whether a read is kept depends only on a hash of its name: the hash is mapped to a number in
+[0, 1) and the read goes into every subset whose fraction is larger than that number. So the
+subsets are nested (every read in the 10x subset is also in the 20x subset), the same reads are
+chosen every time, and the two reads of a pair (whose names differ only by /1 and /2) are always
+kept or dropped together.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import gzip
+import hashlib
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from unicycler_assembly_tests.misc import get_compression_type
+
+
+# Subsampled reads are intermediate files, so they favour speed over size.
+SUBSAMPLE_COMPRESS_LEVEL = 1
+
+
+def format_depth(depth):
+    """
+    Turns a depth into the label used in read set and directory names, e.g. 20.0 -> '20x'.
+    """
+    return '%g' % depth + 'x'
+
+
+def subsample_files(tasks, processes=1):
+    """
+    Each task is (read filename, [(fraction, subsampled filename), ...]). Subsampled files which
+    already exist are left alone, and files with nothing left to make aren't read at all. Files
+    are done in parallel, one per process.
+    """
+    tasks = [(x, [y for y in subsets if not os.path.isfile(y[1])]) for x, subsets in tasks]
+    tasks = [x for x in tasks if x[1]]
+    if not tasks:
+        return
+    print('Subsampling ' + str(len(tasks)) + ' read file' + ('' if len(tasks) == 1 else 's'),
+          flush=True)
+    with ProcessPoolExecutor(max_workers=max(1, min(processes, len(tasks)))) as executor:
+        list(executor.map(subsample_file, tasks))
+
+
+def subsample_file(task):
+    """
+    Streams through a FASTQ once, writing each read to every subset it belongs in. The subsets
+    are written to temporary files and renamed when complete, so an interrupted run never
+    leaves a partial subset behind.
+    """
+    read_filename, subsets = task
+    subsets = sorted(subsets, reverse=True)
+    if get_compression_type(read_filename) == 'gz':
+        open_func = gzip.open
+    else:  # plain text
+        open_func = open
+
+    temp_filenames, raw_files, out_files = [], [], []
+    try:
+        for _, subsampled_filename in subsets:
+            subsampled_dir = os.path.dirname(subsampled_filename)
+            os.makedirs(subsampled_dir, exist_ok=True)
+            temp_fd, temp_filename = tempfile.mkstemp(dir=subsampled_dir, prefix='.subsample_')
+            temp_filenames.append(temp_filename)
+            raw_files.append(os.fdopen(temp_fd, 'wb'))
+            out_files.append(gzip.GzipFile(filename='', fileobj=raw_files[-1], mode='wb',
+                                           compresslevel=SUBSAMPLE_COMPRESS_LEVEL))
+        fractions = [x[0] for x in subsets]
+        with open_func(read_filename, 'rb') as fastq:
+            for header in fastq:
+                if not header.strip():
+                    continue
+                try:
+                    record = header + next(fastq) + next(fastq) + next(fastq)
+                except StopIteration:
+                    sys.exit('Error: ' + read_filename + ' ends with an incomplete FASTQ record')
+                read_hash = get_read_hash(header)
+                for i, fraction in enumerate(fractions):
+                    if read_hash >= fraction:
+                        break  # largest fraction first, so no later subset has this read either
+                    out_files[i].write(record)
+        for out_file, raw_file in zip(out_files, raw_files):
+            out_file.close()
+            raw_file.close()
+        for temp_filename, (_, subsampled_filename) in zip(temp_filenames, subsets):
+            os.replace(temp_filename, subsampled_filename)
+    finally:
+        for raw_file in raw_files:
+            raw_file.close()
+        for temp_filename in temp_filenames:
+            if os.path.isfile(temp_filename):
+                os.remove(temp_filename)
+
+
+def get_read_hash(header):
+    """
+    Maps a FASTQ header line to a number in [0, 1) using the read's name (the first word, without
+    any /1 or /2 pair suffix).
+    """
+    name = header[1:].split(None, 1)[0]
+    if name.endswith(b'/1') or name.endswith(b'/2'):
+        name = name[:-2]
+    digest = hashlib.md5(name).digest()
+    return int.from_bytes(digest[:8], 'big') / 18446744073709551616.0  # 2^64
@@ -0,0 +1,114 @@
+"""
+A report of how assemblies scale with thread count, made from the results of a thread sweep
+(the same read sets assembled at several thread counts).
+
+For each assembler (and setting and version) and each of its steps (plus the whole assembly),
+the report gives the median wall time, CPU time and peak memory at each thread count, along
+with the speedup over the lowest thread count and the parallel efficiency (speedup divided by
+the increase in threads). Speedups are worked out per read set and then the median is taken.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import statistics
+from collections import OrderedDict
+from unicycler_assembly_tests.command_runner import get_program_name
+
+
+REPORT_COLUMNS = ['Assembler', 'Assembler version', 'Assembler setting/output', 'Step',
+                  'Threads', 'Read sets', 'Median wall time (s)', 'Median CPU time (s)',
+                  'Median peak RSS (MB)', 'Speedup', 'Parallel efficiency']
+
+
+def write_scaling_report(results_filename, report_filename):
+    """
+    Writes the report for the results table's successful assemblies (those which have a thread
+    count) and prints the whole-assembly rows.
+    """
+    steps = load_step_times(results_filename)
+    report_rows = []
+    for group, read_set_times in steps.items():
+        thread_counts = sorted(set(t for x in read_set_times.values() for t in x))
+        for threads in thread_counts:
+            times = [x[threads] for x in read_set_times.values() if threads in x]
+            speedups = []
+            for read_set_levels in read_set_times.values():
+                base_threads = min(read_set_levels)
+                if threads in read_set_levels and read_set_levels[threads][0] > 0.0:
+                    speedups.append((read_set_levels[base_threads][0] /
+                                     read_set_levels[threads][0],
+                                     base_threads))
+            if speedups:
+                speedup = '%.2f' % statistics.median(x[0] for x in speedups)
+                efficiency = '%.3f' % statistics.median(x[0] * x[1] / threads
+                                                        for x in speedups)
+            else:
+                speedup, efficiency = '', ''
+            report_rows.append(list(group) + [str(threads), str(len(times)),
+                                              '%.1f' % statistics.median(x[0] for x in times),
+                                              '%.1f' % statistics.median(x[1] for x in times),
+                                              '%.1f' % statistics.median(x[2] for x in times),
+                                              speedup, efficiency])
+
+    with open(report_filename, 'wt') as report:
+        report.write('\t'.join(REPORT_COLUMNS) + '\n')
+        for row in report_rows:
+            report.write('\t'.join(row) + '\n')
+
+    print()
+    print('Thread scaling (whole assemblies, medians over read sets):')
+    for row in report_rows:
+        if row[3] == 'all':
+            print('  ' + ' '.join(row[:3]) + ', ' + row[4] + ' threads: ' + row[6] + ' s, ' +
+                  'speedup ' + row[9] + ', efficiency ' + row[10])
+    print('Full report (including each step): ' + report_filename, flush=True)
+
+
+def load_step_times(results_filename):
+    """
+    Returns an OrderedDict of (assembler, version, setting, step) to a dictionary of read set
+    name to a dictionary of thread count to (wall time, CPU time, peak RSS). The step is 'all'
+    for the whole assembly or '<number>: <program>' for one command.
+    """
+    steps = OrderedDict()
+    with open(results_filename, 'rt') as results_table:
+        headers = results_table.readline().rstrip('\n').split('\t')
+        for line in results_table:
+            row = dict(zip(headers, line.rstrip('\n').split('\t')))
+            if row.get('Assembly result') != 'success' or not row.get('Threads'):
+                continue
+            try:
+                threads = int(row['Threads'])
+                step_times = [('all', float(row['Assembly time (seconds)']),
+                               float(row['Assembly user CPU time (seconds)']) +
+                               float(row['Assembly system CPU time (seconds)']),
+                               float(row['Assembly peak RSS (MB)']))]
+                step_times += get_command_times(row)
+            except (KeyError, ValueError):
+                continue
+            group = (row['Assembler'], row['Assembler version'],
+                     row['Assembler setting/output'])
+            for step, wall_time, cpu_time, peak_rss in step_times:
+                read_set_times = steps.setdefault(group + (step,), OrderedDict())
+                read_set_times.setdefault(row['Read set name'], {})[threads] = \
+                    (wall_time, cpu_time, peak_rss)
+    return steps
+
+
+def get_command_times(row):
+    """
+    Returns (step, wall time, CPU time, peak RSS) for each of a result's commands.
+    """
+    wall_times = [float(x) for x in row['Command wall times (seconds)'].split(', ') if x]
+    cpu_times = [float(x) for x in row['Command CPU times (seconds)'].split(', ') if x]
+    peak_rss = [float(x) for x in row['Command peak RSS (MB)'].split(', ') if x]
+    commands = row['Assembly command(s)'].split('; ')
+    if not (len(wall_times) == len(cpu_times) == len(peak_rss)):
+        return []
+    command_times = []
+    for i in range(len(wall_times)):
+        program = get_program_name(commands[i]) if len(commands) == len(wall_times) else ''
+        step = str(i + 1) + (': ' + program if program else '')
+        command_times.append((step, wall_times[i], cpu_times[i], peak_rss[i]))
+    return command_times
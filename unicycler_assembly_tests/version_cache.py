@@ -0,0 +1,70 @@
+"""
+An on-disk cache of assembler versions, so they don't need to be probed (which can mean starting
+a JVM) every time assembler_comparison runs.
+
+Versions are keyed by the resolved path of the probed program and its modification time, so
+installing a new version (or putting a different one first in PATH) gives a new key.
+
+Author: Ryan Wick
+email: rrwick@gmail.com
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+
+VERSION_CACHE_FILENAME = 'assembler_versions.json'
+
+
+def get_default_cache_dir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'unicycler_assembly_tests')
+
+
+def get_version_cache_key(program):
+    """
+    Returns the cache key for a program (e.g. 'spades.py'), or None if it can't be found.
+    """
+    program_path = shutil.which(program)
+    if program_path is None:
+        return None
+    program_path = os.path.realpath(program_path)
+    try:
+        mtime = os.path.getmtime(program_path)
+    except OSError:
+        return None
+    return program_path + ':' + '%.6f' % mtime
+
+
+def load_version_cache(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, VERSION_CACHE_FILENAME), 'rt') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_cached_version(cache_dir, key):
+    if cache_dir is None or key is None:
+        return None
+    return load_version_cache(cache_dir).get(key)
+
+
+def save_cached_version(cache_dir, key, version):
+    """
+    Adds a version to the cache. The file is replaced atomically, so concurrent runs can't
+    corrupt it (at worst one's addition is lost and it will be probed again next time).
+    """
+    if cache_dir is None or key is None or version is None:
+        return
+    cache = load_version_cache(cache_dir)
+    cache[key] = version
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_fd, temp_filename = tempfile.mkstemp(dir=cache_dir, prefix='.versions_')
+        with os.fdopen(temp_fd, 'wt') as temp_file:
+            json.dump(cache, temp_file, indent=1, sort_keys=True)
+        os.replace(temp_filename, os.path.join(cache_dir, VERSION_CACHE_FILENAME))
+    except OSError:
+        pass